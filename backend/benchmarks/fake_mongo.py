@@ -0,0 +1,180 @@
+"""
+In-memory stand-in for the parts of Motor the backend uses, so the load tests don't need a Mongo server.
+
+Every call yields to the event loop (after `latency` seconds, if set) like a real round-trip would.
+Only the query features the backend relies on are supported: equality, $gte/$lte ranges, include/exclude
+projections, single-key sorts, $set and $inc updates and upserts.
+
+Bulk writes take this module's `UpdateOne`, so it has to replace pymongo's alongside the client.
+"""
+
+import asyncio
+import copy
+import itertools
+from types import SimpleNamespace
+
+_ids = itertools.count()
+
+
+def _matches(document, query):
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict):
+            if "$gte" in condition and (value is None or value < condition["$gte"]):
+                return False
+            if "$lte" in condition and (value is None or value > condition["$lte"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+
+    included = {key for key, value in projection.items() if value}
+    if not included:
+        return {key: copy.deepcopy(value) for key, value in document.items() if key not in projection}
+
+    projected = {key: copy.deepcopy(document[key]) for key in included if key in document}
+    if projection.get("_id", 1) and "_id" in document:
+        projected["_id"] = document["_id"]
+    return projected
+
+
+def _apply_update(document, update):
+    document.update(copy.deepcopy(update.get("$set", {})))
+    for key, amount in update.get("$inc", {}).items():
+        document[key] = document.get(key, 0) + amount
+
+
+def _index_name(keys):
+    if isinstance(keys, str):
+        return f"{keys}_1"
+    return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+
+class UpdateOne:
+    """Drop-in for pymongo's `UpdateOne`, which keeps its arguments private."""
+
+    def __init__(self, query, update, upsert=False):  # noqa: FBT002 - pymongo's signature
+        self.query = query
+        self.update = update
+        self.upsert = upsert
+
+
+class InMemoryCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key, direction=1):
+        self._documents.sort(key=lambda document: document.get(key), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(InMemoryMotorClient.latency)
+        return self._documents if length is None else self._documents[:length]
+
+
+class InMemoryCollection:
+    def __init__(self):
+        self.documents = {}
+        self.indexes = {}
+
+    async def _round_trip(self):
+        await asyncio.sleep(InMemoryMotorClient.latency)
+
+    async def create_index(self, keys, **options):
+        await self._round_trip()
+        name = _index_name(keys)
+        self.indexes[name] = options
+        return name
+
+    async def index_information(self):
+        await self._round_trip()
+        return dict(self.indexes)
+
+    async def drop_index(self, name):
+        await self._round_trip()
+        self.indexes.pop(name, None)
+
+    async def find_one(self, query=None, projection=None):
+        await self._round_trip()
+        for document in self._find(query):
+            return _project(document, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return InMemoryCursor([_project(document, projection) for document in self._find(query)])
+
+    async def insert_many(self, documents, *, ordered=True):
+        await self._round_trip()
+        for document in documents:
+            document.setdefault("_id", next(_ids))
+            self.documents[document["_id"]] = copy.deepcopy(document)
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    async def update_one(self, query, update, *, upsert=False):
+        await self._round_trip()
+        return self._update(query, update, upsert=upsert)
+
+    async def replace_one(self, query, replacement, *, upsert=False):
+        await self._round_trip()
+        for document in self._find(query):
+            _id = document["_id"]
+            document.clear()
+            document.update(copy.deepcopy(replacement), _id=_id)
+            return SimpleNamespace(matched_count=1)
+
+        if upsert:
+            document = {**copy.deepcopy(replacement)}
+            document.setdefault("_id", query.get("_id", next(_ids)))
+            self.documents[document["_id"]] = document
+        return SimpleNamespace(matched_count=0)
+
+    async def bulk_write(self, operations, *, ordered=True):
+        await self._round_trip()
+        for operation in operations:
+            self._update(operation.query, operation.update, upsert=operation.upsert)
+        return SimpleNamespace(modified_count=len(operations))
+
+    async def delete_many(self, query):
+        await self._round_trip()
+        for document in list(self._find(query)):
+            del self.documents[document["_id"]]
+
+    def _find(self, query):
+        return (document for document in self.documents.values() if _matches(document, query or {}))
+
+    def _update(self, query, update, upsert):
+        for document in self._find(query):
+            _apply_update(document, update)
+            return SimpleNamespace(matched_count=1)
+
+        if upsert:
+            document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            _apply_update(document, update)
+            document.setdefault("_id", next(_ids))
+            self.documents[document["_id"]] = document
+        return SimpleNamespace(matched_count=0)
+
+
+class InMemoryDatabase(dict):
+    def __missing__(self, name):
+        self[name] = InMemoryCollection()
+        return self[name]
+
+
+class InMemoryMotorClient(dict):
+    """Drop-in for `AsyncIOMotorClient`; the URI is ignored."""
+
+    # seconds every call waits before answering
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+    def __missing__(self, name):
+        self[name] = InMemoryDatabase()
+        return self[name]
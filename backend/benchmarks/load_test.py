@@ -0,0 +1,352 @@
+"""
+End-to-end load test of `src.app:app`.
+
+Boots the app in-process (lifespan included) over ASGI against an in-memory Motor stand-in, or a real Mongo
+with --mongo-uri, and a stub Gemini client with a fixed latency. A seeded, weighted mix of requests is then
+driven at a fixed concurrency and the latencies, throughput and per-stage timings are written out as JSON.
+
+Everything random is derived from --seed, so two runs with the same flags on different commits are comparable.
+
+    cd backend && python -m benchmarks.load_test --requests 2000 --concurrency 32 --output bench.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from datetime import timedelta
+from importlib.metadata import version
+from pathlib import Path
+
+import numpy as np
+
+# the app reads its configuration at import time
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+os.environ.setdefault("MONGO_COLLECTION_NAME", "series")
+
+import httpx
+
+from .fake_mongo import InMemoryMotorClient
+from .fake_mongo import UpdateOne
+from .stub_gemini import StubGeminiClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PERCENTILES = (50, 95, 99)
+FIRST_DAY = datetime(2024, 1, 1)  # noqa: DTZ001 - series days are stored as naive local midnights
+RANGE_DAYS = 7
+# generous, it only turns a hung request into an error instead of stalling the run
+REQUEST_TIMEOUT = 60.0
+
+DEFAULT_MIX = {
+    "simulate_day": 6,
+    "simulate_day_prompt": 2,
+    "simulate_range": 1,
+    "summarize": 1,
+    "submit_physical_attributes": 0.5,
+}
+
+PROMPTS = (
+    "What if I started drinking every weekend?",
+    "What if I quit smoking?",
+    "What if I were ten years older?",
+    "What if I stopped exercising?",
+    "What if I lost 10 kg?",
+    # not something the local prompt rules understand, so it always goes to Gemini
+    "What if I had type 2 diabetes?",
+)
+
+SERIES_VALUE_RANGES = {
+    "HKQuantityTypeIdentifierHeartRate": (50.0, 140.0),
+    "HKQuantityTypeIdentifierStepCount": (0.0, 1500.0),
+    "HKQuantityTypeIdentifierRespiratoryRate": (12.0, 20.0),
+}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            msg = f"Unknown workload '{name}', expected one of {', '.join(DEFAULT_MIX)}"
+            raise argparse.ArgumentTypeError(msg)
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class StageTimer:
+    """
+    Collects the durations of the app's internal awaitables, keyed by stage name.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.enabled = False
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                if self.enabled:
+                    self.durations[name].append(time.perf_counter() - started)
+
+        return timed
+
+    def patch(self, owner, attribute, name):
+        setattr(owner, attribute, self.wrap(name, getattr(owner, attribute)))
+
+
+def random_physical_attributes(rng: random.Random) -> dict:
+    return {
+        "age": rng.randint(18, 40),
+        "height": round(rng.uniform(155, 195), 1),
+        "weight": round(rng.uniform(50, 110), 1),
+        "is_physically_active": rng.random() < 0.5,  # noqa: PLR2004
+        "is_smoker": rng.random() < 0.2,  # noqa: PLR2004
+        "alcohol_consumption": round(rng.uniform(0, 1), 2),
+    }
+
+
+def random_series_days(rng: random.Random, days: int) -> list[dict]:
+    return [
+        {
+            "timestamp": FIRST_DAY + timedelta(days=day),
+            **{
+                key: [round(rng.uniform(low, high), 1) for _ in range(24)]
+                for key, (low, high) in SERIES_VALUE_RANGES.items()
+            },
+        }
+        for day in range(days)
+    ]
+
+
+def build_requests(args, rng: random.Random, count: int) -> list[tuple[str, dict]]:
+    """
+    Draws `count` (workload, httpx request options) pairs from the configured mix.
+    """
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+
+    requests = []
+    for name in rng.choices(names, weights=weights, k=count):
+        user_id = f"user-{rng.randrange(args.users)}"
+        day = FIRST_DAY + timedelta(days=rng.randrange(args.days))
+        options = {"headers": {"x-user-id": user_id}}
+
+        if name in {"simulate_day", "simulate_day_prompt"}:
+            prompt = rng.choice(PROMPTS) if name == "simulate_day_prompt" else ""
+            options |= {
+                "method": "GET",
+                "url": "/get_or_simulate_day/",
+                "json": {"timestamp": day.isoformat(), "prompt": prompt},
+            }
+        elif name == "simulate_range":
+            start = FIRST_DAY + timedelta(days=rng.randrange(max(1, args.days - RANGE_DAYS)))
+            options |= {
+                "method": "GET",
+                "url": "/simulate_range/",
+                "json": {"start": start.isoformat(), "end": (start + timedelta(days=RANGE_DAYS - 1)).isoformat()},
+            }
+        elif name == "summarize":
+            options |= {"method": "POST", "url": "/summarize"}
+        else:
+            options |= {
+                "method": "POST",
+                "url": "/submit-physical-attributes/",
+                "json": random_physical_attributes(rng),
+            }
+        requests.append((name, options))
+    return requests
+
+
+async def drive(client: httpx.AsyncClient, requests, concurrency: int) -> tuple[dict, dict, float]:
+    """
+    Sends `requests` from `concurrency` workers, returning per-workload latencies, error counts and wall time.
+    """
+    queue = iter(requests)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def worker():
+        for name, options in queue:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**options)
+                # range responses stream, so time until the last day has arrived
+                await response.aread()
+                failed = response.is_error
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize_durations(durations: list[float]) -> dict:
+    if not durations:
+        return {"count": 0}
+
+    milliseconds = np.asarray(durations) * 1000
+    summary = {"count": len(durations), "mean_ms": float(milliseconds.mean())}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}_ms"] = float(np.percentile(milliseconds, percentile))
+    summary["max_ms"] = float(milliseconds.max())
+    return summary
+
+
+def git_revision() -> dict:
+    def git(*command):
+        result = subprocess.run(  # noqa: S603 - fixed git arguments
+            ["git", *command],  # noqa: S607
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        return result.stdout.strip()
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def versions() -> dict:
+    return {
+        "python": platform.python_version(),
+        "torch": version("torch"),
+        "numpy": np.__version__,
+        "fastapi": version("fastapi"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+async def run(args) -> dict:
+    if args.mongo_uri is not None:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+    # imported only now, as the app reads its configuration at import time
+    import src.database  # noqa: PLC0415
+    import src.gemini  # noqa: PLC0415
+    from src.app import app  # noqa: PLC0415
+
+    if args.mongo_uri is None:
+        InMemoryMotorClient.latency = args.mongo_latency
+        src.database.AsyncIOMotorClient = InMemoryMotorClient
+        src.database.UpdateOne = UpdateOne
+
+    gemini = StubGeminiClient(latency=args.gemini_latency)
+    src.gemini.client = gemini
+
+    app_module = sys.modules["src.app"]
+    db = src.database.db
+
+    stages = StageTimer()
+    for function in ("rewrite_physical_attributes", "evaluate_day_batched", "run_inference"):
+        stages.patch(app_module, function, function)
+    for method in (
+        "get_physical_attributes",
+        "get_physical_attributes_and_revision",
+        "set_physical_attributes",
+        "get_series_day",
+        "get_series_range",
+    ):
+        stages.patch(db, method, f"db.{method}")
+    for method in ("get", "set"):
+        stages.patch(app_module.simulation_cache, method, f"simulation_cache.{method}")
+
+    rng = random.Random(args.seed)  # noqa: S311 - a reproducible workload, nothing secret
+    # an unhandled error in the app is a 500 for the request that hit it, not the end of the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=REQUEST_TIMEOUT) as client,
+    ):
+        # start from an empty database so cached results from an earlier run can't skew this one
+        for collection in (db.collection, db.physical_attributes_collection, db.results_collection):
+            await collection.delete_many({})
+        await db.gemini_cache_collection.delete_many({})
+
+        for user in range(args.users):
+            user_id = f"user-{user}"
+            await db.set_physical_attributes(user_id, random_physical_attributes(rng))
+            await db.upsert_series_days(user_id, random_series_days(rng, args.days))
+
+        if args.warmup:
+            await drive(client, build_requests(args, rng, args.warmup), args.concurrency)
+
+        gemini.durations.clear()
+        stages.enabled = True
+        latencies, errors, duration = await drive(client, build_requests(args, rng, args.requests), args.concurrency)
+        stages.enabled = False
+
+        inference_stats = (await client.get("/inference-stats/")).json()
+        cache_stats = (await client.get("/cache-stats/")).json()
+        prompt_stats = (await client.get("/prompt-stats/")).json()
+
+    completed = sum(len(durations) for durations in latencies.values())
+    stage_durations = {**stages.durations, "gemini": gemini.durations}
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "git": git_revision(),
+        "versions": versions(),
+        "duration_s": duration,
+        "throughput_rps": completed / duration,
+        "overall": {
+            **summarize_durations([value for durations in latencies.values() for value in durations]),
+            "errors": sum(errors.values()),
+        },
+        "endpoints": {
+            name: {**summarize_durations(latencies[name]), "errors": errors[name]} for name in sorted(latencies)
+        },
+        "stages": {name: summarize_durations(stage_durations[name]) for name in sorted(stage_durations)},
+        "inference": inference_stats,
+        "caches": cache_stats,
+        "prompts": prompt_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the simulation API end to end")
+    parser.add_argument("--requests", type=int, default=1000, help="Measured requests")
+    parser.add_argument("--warmup", type=int, default=100, help="Unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at any time")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="Weighted workloads, e.g. simulate_day=6,summarize=1 (default: %(default)s)",
+    )
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=60, help="Days of series data seeded per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Seconds per stub Gemini call")
+    parser.add_argument("--mongo-latency", type=float, default=0.001, help="Seconds per in-memory Mongo call")
+    parser.add_argument("--mongo-uri", default=None, help="Use a real Mongo instead of the in-memory one")
+    parser.add_argument("--output", type=Path, default=None, help="Write the report here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2, default=str)
+    if args.output is None:
+        print(report)
+    else:
+        args.output.write_text(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Offline stand-in for the `genai.Client` the backend talks to, answering after a configurable latency.
+"""
+
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+
+# the attributes JSON the rewrite prompt asks to be edited
+ATTRIBUTES_PATTERN = re.compile(r"\{[^{}]*\"age\"[^{}]*\}")
+
+
+def stub_response(prompt: str) -> str:
+    """
+    Echoes the physical attributes back for the rewrite prompt, and summarizes anything else.
+    """
+    match = ATTRIBUTES_PATTERN.search(prompt)
+    if match and "Try to replace values" in prompt:
+        attributes = json.loads(match.group(0))
+        attributes["age"] = min(40, attributes["age"] + 5)
+        return f"```json\n{json.dumps(attributes, indent=2)}\n```"
+
+    return json.dumps({"summary": "A stub summary of the health data."})
+
+
+class StubModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        started = time.perf_counter()
+        time.sleep(self._client.latency)
+        self._client.record(time.perf_counter() - started)
+        return SimpleNamespace(text=stub_response(contents))
+
+
+class StubAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        started = time.perf_counter()
+        await asyncio.sleep(self._client.latency)
+        self._client.record(time.perf_counter() - started)
+        return SimpleNamespace(text=stub_response(contents))
+
+
+class StubGeminiClient:
+    """
+    Drop-in for `src.gemini.client`, with `.models` and `.aio.models` like the real one.
+
+    Keeps the duration of every call so the load test can report Gemini time on its own.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.durations: list[float] = []
+        self.models = StubModels(self)
+        self.aio = SimpleNamespace(models=StubAsyncModels(self))
+
+    def record(self, duration: float):
+        self.durations.append(duration)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from .normalization import SERIES
+except ImportError:
+    # imported as a top-level module by the scripts in this directory
+    from normalization import SERIES
+
+# in the order the models take them
+SERIES_TYPES = SERIES.keys
+
+# heart and respiratory rate are averaged per hour, step counts are summed
+MEAN_TYPES = np.array([True, False, True])
+
+
+def local_days_and_hours(start_dates) -> tuple[np.ndarray, np.ndarray]:
+    """
+    ISO timestamps -> (datetime64[D] local day, local hour) arrays.
+
+    Only the wall-clock part is parsed, which is what the per-day grouping has always used.
+    """
+    local = np.asarray(start_dates, dtype="U19").astype("datetime64[s]")
+    days = local.astype("datetime64[D]")
+    hours = ((local - days) // np.timedelta64(1, "h")).astype(np.intp)
+    return days, hours
+
+
+def type_indices(types) -> np.ndarray:
+    """
+    Maps record types onto their index in `SERIES_TYPES`, -1 for anything else.
+    """
+    types = np.asarray(types)
+    indices = np.full(types.shape, -1, dtype=np.intp)
+    for i, type_ in enumerate(SERIES_TYPES):
+        indices[types == type_] = i
+    return indices
+
+
+def accumulate_hourly(
+    day_indices: np.ndarray,
+    hours: np.ndarray,
+    types: np.ndarray,
+    values: np.ndarray,
+    num_days: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Scatters samples into (num_days, 24, 3) per-hour sums and counts.
+
+    Sums and counts from several chunks of the same export can simply be added together.
+    """
+    flat = (day_indices * 24 + hours) * len(SERIES_TYPES) + types
+    size = num_days * 24 * len(SERIES_TYPES)
+
+    sums = np.bincount(flat, weights=values, minlength=size).reshape(num_days, 24, len(SERIES_TYPES))
+    counts = np.bincount(flat, minlength=size).reshape(num_days, 24, len(SERIES_TYPES))
+    return sums, counts
+
+
+def finalize_hourly(sums: np.ndarray, counts: np.ndarray, dtype=np.float32) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (D, 24, 3) sums and counts -> (D, 24, 3) hourly series and a (D,) mask of valid days.
+
+    Rates are averaged and linearly interpolated over empty hours (extending flat at both ends),
+    steps are summed with empty hours left at 0. Days with no rate samples at all stay invalid.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    series = np.where(MEAN_TYPES, means, sums)
+
+    # interpolate every (day, type) column in a single call
+    num_days = series.shape[0]
+    columns = series.transpose(1, 0, 2).reshape(24, -1)
+    interpolated = pd.DataFrame(columns).interpolate(method="linear", limit_direction="both").to_numpy()
+    series = interpolated.reshape(24, num_days, len(SERIES_TYPES)).transpose(1, 0, 2)
+
+    valid = ~np.isnan(series).any(axis=(1, 2))
+    return series.astype(dtype), valid
+
+
+def aggregate_hourly(start_dates, types, values, dtype=np.float32) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Raw samples -> (D,) datetime64[D] days, (D, 24, 3) hourly series, (D,) valid mask.
+    """
+    type_index = type_indices(types)
+    keep = type_index >= 0
+
+    days, hours = local_days_and_hours(np.asarray(start_dates)[keep])
+    unique_days, day_indices = np.unique(days, return_inverse=True)
+
+    sums, counts = accumulate_hourly(
+        day_indices,
+        hours,
+        type_index[keep],
+        np.asarray(values, dtype=np.float64)[keep],
+        len(unique_days),
+    )
+    series, valid = finalize_hourly(sums, counts, dtype)
+    return unique_days, series, valid
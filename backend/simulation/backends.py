@@ -0,0 +1,130 @@
+import logging
+from pathlib import Path
+
+import torch
+
+logger = logging.getLogger("terrahacks-simulation.backends")
+
+BACKENDS = ("eager", "torchscript", "onnxruntime")
+
+# model name -> (input names, output names), shared by the exporter and the runtime backends
+MODEL_SIGNATURES = {
+    "blood_estimation": (("series", "physical"), ("blood",)),
+    "risk_score": (("blood",), ("index", "risks")),
+}
+
+EXPORT_SUFFIXES = {
+    "torchscript": ".torchscript",
+    "onnxruntime": ".onnx",
+}
+
+
+def exported_path(export_dir: str | Path, model_name: str, backend: str) -> Path:
+    return Path(export_dir) / f"{model_name}{EXPORT_SUFFIXES[backend]}"
+
+
+def _unwrap(outputs):
+    return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+class EagerBackend:
+    """Runs the nn.Module as is."""
+
+    name = "eager"
+
+    def __init__(self, model: torch.nn.Module, device: torch.device):
+        self.model = model.to(device).eval()
+        self.device = device
+
+    def __call__(self, *inputs: torch.Tensor) -> torch.Tensor | tuple[torch.Tensor, ...]:
+        return self.run("forward", *inputs)
+
+    def supports(self, method: str) -> bool:
+        """Whether `run` can call `method`, e.g. a single stage of a model. Traced exports only have forward."""
+        return callable(getattr(self.model, method, None))
+
+    def run(self, method: str, *inputs: torch.Tensor) -> torch.Tensor | tuple[torch.Tensor, ...]:
+        fn = self.model if method == "forward" else getattr(self.model, method)
+        with torch.no_grad():
+            outputs = fn(*(tensor.to(self.device) for tensor in inputs))
+        if isinstance(outputs, tuple):
+            return tuple(output.cpu() for output in outputs)
+        return outputs.cpu()
+
+
+class TorchScriptBackend(EagerBackend):
+    """Runs a frozen TorchScript module written by `simulation.export`, skipping Python dispatch per layer."""
+
+    name = "torchscript"
+
+    def __init__(self, path: str | Path, device: torch.device):
+        super().__init__(torch.jit.load(str(path), map_location=device), device)
+
+
+class OnnxRuntimeBackend:
+    """
+    Runs an ONNX graph written by `simulation.export` on onnxruntime's CPU provider.
+    onnxruntime is optional and only imported when this backend is selected.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, path: str | Path, intra_op_threads: int = 1):
+        try:
+            import onnxruntime as ort  # noqa: PLC0415
+        except ImportError as e:
+            msg = "The onnxruntime inference backend needs the onnxruntime package (pip install onnxruntime)"
+            raise RuntimeError(msg) from e
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def supports(self, method: str) -> bool:
+        return method == "forward"
+
+    def __call__(self, *inputs: torch.Tensor) -> torch.Tensor | tuple[torch.Tensor, ...]:
+        feeds = {name: tensor.numpy() for name, tensor in zip(self.input_names, inputs, strict=True)}
+        return _unwrap([torch.from_numpy(output) for output in self.session.run(None, feeds)])
+
+
+def load_backend(
+    backend: str,
+    model: torch.nn.Module,
+    model_name: str,
+    export_dir: str | Path,
+    device: torch.device,
+    intra_op_threads: int = 1,
+):
+    """
+    Wraps `model` in the requested backend. Falls back to eager when the exported artifact doesn't exist yet,
+    or when an exported backend is asked to run off the CPU.
+    """
+    if backend not in BACKENDS:
+        msg = f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}"
+        raise ValueError(msg)
+    if backend == "eager":
+        return EagerBackend(model, device)
+
+    path = exported_path(export_dir, model_name, backend)
+    if not path.exists():
+        logger.warning(
+            "No %s export of %s at %s (run `python -m simulation.export`), using eager",
+            backend,
+            model_name,
+            path,
+        )
+        return EagerBackend(model, device)
+
+    if backend == "torchscript":
+        return TorchScriptBackend(path, device)
+
+    if device.type != "cpu":
+        logger.warning("The onnxruntime backend only runs on CPU, using eager on %s for %s", device, model_name)
+        return EagerBackend(model, device)
+    return OnnxRuntimeBackend(path, intra_op_threads)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from collections import Counter
+from typing import TYPE_CHECKING
+from typing import Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from concurrent.futures import Executor
+
+    import torch
+
+logger = logging.getLogger("terrahacks-simulation.batching")
+
+
+class MicroBatcher:
+    """
+    Collects single-sample inference calls from concurrent requests and runs them as one batched forward pass.
+
+    A batch is flushed once `max_batch_size` calls are queued or the oldest queued call has waited `max_wait`
+    seconds, whichever comes first. `forward` receives the stacked inputs (B, ...) and returns a tensor or a
+    tuple of tensors whose first dimension is B; every caller gets back its own row.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[..., torch.Tensor | tuple[torch.Tensor, ...]],
+        *,
+        max_batch_size: int = 64,
+        max_wait: float = 0.005,
+        executor: Executor | None = None,
+        name: str = "batcher",
+    ):
+        self._forward = forward
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._executor = executor
+        self.name = name
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._batch_size_histogram: Counter[int] = Counter()
+
+    async def submit(self, *inputs: torch.Tensor) -> torch.Tensor | tuple[torch.Tensor, ...]:
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((inputs, future))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def stop(self):
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._worker
+        self._worker = None
+
+        # anyone still waiting would otherwise hang forever
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        self._queue = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+            # bucketed by the next power of two, i.e. {"4": n} counts batches of 3 or 4 items
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_size_histogram.items())},
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run(), name=f"{self.name}-worker")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+
+            while len(batch) < self._max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[tuple[torch.Tensor, ...], asyncio.Future]]):
+        batch = [(inputs, future) for inputs, future in batch if not future.cancelled()]
+        if not batch:
+            return
+
+        self._batches += 1
+        self._items += len(batch)
+        self._batch_size_histogram[1 << (len(batch) - 1).bit_length()] += 1
+
+        import torch  # noqa: PLC0415 - importing the batcher shouldn't import torch
+
+        try:
+            # inside the try, so a row of the wrong shape fails its batch instead of killing the worker
+            stacked = [torch.stack(column) for column in zip(*(inputs for inputs, _ in batch), strict=True)]
+            outputs = await asyncio.get_running_loop().run_in_executor(self._executor, self._forward, *stacked)
+        except Exception as e:
+            logger.exception("Batched forward pass failed in '%s'", self.name)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if isinstance(outputs, tuple):
+                future.set_result(tuple(output[i] for output in outputs))
+            else:
+                future.set_result(outputs[i])
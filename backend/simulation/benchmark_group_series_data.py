@@ -0,0 +1,153 @@
+"""
+Benchmarks `group_series_data` against the original per-record implementation on synthetic exports.
+
+    python simulation/benchmark_group_series_data.py [--years 1 2 4] [--samples-per-hour 12]
+
+Checks both produce the same days and series, then prints the timings as JSON.
+"""
+
+import argparse
+import json
+import time
+import warnings
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import numpy as np
+import pandas as pd
+from aggregation import SERIES_TYPES
+from generate_training_data import group_series_data
+
+
+def group_series_data_legacy(data):  # noqa: C901, PLR0912 - kept as it was, to compare against
+    """The original implementation, kept here as the reference."""
+    grouped = {}
+    arr = list(SERIES_TYPES)
+
+    for k in arr:
+        for entry in data[k]["records"]["data"]:
+            timestamp = entry.get("start_date")
+            if not timestamp:
+                continue
+
+            dt = datetime.fromisoformat(timestamp)
+            day = dt.date().isoformat()
+            hour = dt.hour % 24
+            type_ = entry["type"]
+
+            if type_ not in arr:
+                continue
+
+            if day not in grouped:
+                grouped[day] = {k: [[] for _ in range(24)] for k in arr}
+
+            grouped[day][type_][hour].append(entry["value"])
+
+    for day_entry in grouped.values():
+        for type_entry in day_entry:
+            for hour in range(24):
+                if type_entry in ["HKQuantityTypeIdentifierHeartRate", "HKQuantityTypeIdentifierRespiratoryRate"]:
+                    day_entry[type_entry][hour] = np.mean(day_entry[type_entry][hour])
+                else:
+                    day_entry[type_entry][hour] = (
+                        np.sum(day_entry[type_entry][hour]) if day_entry[type_entry][hour] else 0.0
+                    )
+
+    for day_entry in grouped.values():
+        for type_entry in day_entry:
+            if type_entry in ["HKQuantityTypeIdentifierHeartRate", "HKQuantityTypeIdentifierRespiratoryRate"]:
+                series = pd.Series(day_entry[type_entry]).interpolate(method="linear", limit_direction="both")
+                day_entry[type_entry] = list(series.to_numpy().tolist())
+
+    def clean_day_entry(day_entry):
+        for type_entry in day_entry:
+            for i in range(len(day_entry[type_entry])):
+                if np.isnan(day_entry[type_entry][i]):
+                    return False
+                day_entry[type_entry][i] = float(day_entry[type_entry][i])
+        return True
+
+    for day_entry in grouped.values():
+        if not clean_day_entry(day_entry):
+            day_entry.clear()
+
+    return [{"day": day, "series_data": entry} for day, entry in grouped.items() if entry != {}]
+
+
+def synthetic_export(days, samples_per_hour, seed=0):
+    """
+    An export in the shape `group_series_data` reads, with gaps: some hours have no samples and
+    roughly one day in twenty has no respiratory rate at all, which makes it invalid.
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=9)))
+    data = {type_: {"records": {"data": []}} for type_ in SERIES_TYPES}
+    value_ranges = {
+        "HKQuantityTypeIdentifierHeartRate": (50, 150),
+        "HKQuantityTypeIdentifierStepCount": (0, 200),
+        "HKQuantityTypeIdentifierRespiratoryRate": (10, 20),
+    }
+
+    for day in range(days):
+        skip_respiratory = rng.random() < 0.05  # noqa: PLR2004
+        for hour in range(24):
+            for type_, (low, high) in value_ranges.items():
+                if rng.random() < 0.2 or (skip_respiratory and type_ == "HKQuantityTypeIdentifierRespiratoryRate"):  # noqa: PLR2004
+                    continue
+                for minute in np.sort(rng.integers(0, 60, samples_per_hour)):
+                    timestamp = start + timedelta(days=day, hours=hour, minutes=int(minute))
+                    data[type_]["records"]["data"].append(
+                        {
+                            "type": type_,
+                            "start_date": timestamp.isoformat(),
+                            "value": float(rng.integers(low, high)),
+                        },
+                    )
+    return data
+
+
+def timed(fn, data):
+    start = time.perf_counter()
+    result = fn(data)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--samples-per-hour", type=int, default=12)
+    args = parser.parse_args()
+
+    # the legacy implementation takes np.mean of empty hours on purpose
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    report = []
+    for years in args.years:
+        data = synthetic_export(round(365 * years), args.samples_per_hour)
+        records = sum(len(data[type_]["records"]["data"]) for type_ in SERIES_TYPES)
+
+        legacy, legacy_seconds = timed(group_series_data_legacy, data)
+        columnar, columnar_seconds = timed(group_series_data, data)
+
+        legacy = sorted(legacy, key=lambda entry: entry["day"])
+        if legacy != columnar:
+            msg = f"group_series_data disagrees with the legacy implementation for {years} years of data"
+            raise AssertionError(msg)
+
+        report.append(
+            {
+                "years": years,
+                "records": records,
+                "valid_days": len(columnar),
+                "legacy_seconds": round(legacy_seconds, 3),
+                "columnar_seconds": round(columnar_seconds, 3),
+                "speedup": round(legacy_seconds / columnar_seconds, 1),
+            },
+        )
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
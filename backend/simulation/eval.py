@@ -1,31 +1,70 @@
-import torch
+from __future__ import annotations
 
-from .neural_network.neural_net import EstimateBloodAttributesNet
-from .neural_network.neural_net import RiskScoreNet
-from .normalization import denormalize_blood_values
-from .normalization import normalize_blood_values
-from .normalization import normalize_physical_attributes
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 import numpy as np
 
+from .batching import MicroBatcher
+from .metrics import span
+from .metrics import timed
+from .normalization import BLOOD_VALUES
+from .normalization import PHYSICAL_ATTRIBUTES
+from .normalization import SERIES
+from .registry import MODEL_WEIGHTS_DIR
+from .registry import ModelRegistry
+
+if TYPE_CHECKING:
+    import torch
+
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", str(os.cpu_count() or 1)))
+# eager, torchscript or onnxruntime; the latter two need `python -m simulation.export` to have been run
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+INFERENCE_EXPORT_DIR = os.getenv("INFERENCE_EXPORT_DIR", str(MODEL_WEIGHTS_DIR / "exported"))
+# cpu or cuda, picked automatically when unset
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE") or None
+# float32, int8-dynamic, int8-static or bfloat16, see `python -m simulation.quantization` for the accuracy cost
+INFERENCE_VARIANT = os.getenv("INFERENCE_VARIANT", "float32")
+# serve the top-k runs saved by `training.py --top-k` as averaged ensembles, on the eager backend only
+INFERENCE_ENSEMBLE = os.getenv("INFERENCE_ENSEMBLE", "false").lower() == "true"
+# the models are tiny, so splitting a single forward pass across cores costs more than it saves
+INFERENCE_INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", "1"))
+
+# torch releases the GIL inside its kernels, so a thread per core keeps forward passes off the event loop
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+
+
+SERIES_RANGES = SERIES.ranges
+
+
+def configure_inference_threads():
+    """
+    Applies `INFERENCE_INTRA_OP_THREADS` to torch. The setting is process wide, so the server calls this at startup
+    instead of it happening to whatever imports this module.
+    """
+    import torch  # noqa: PLC0415 - torch is imported on first inference, not with this module
 
-def normalize_series_data(series_data: list[list[float]]) -> torch.Tensor:
-    RANGES = {
-        "HKQuantityTypeIdentifierHeartRate": (40.0, 180.0),
-        "HKQuantityTypeIdentifierStepCount": (0.0, 3000.0),
-        "HKQuantityTypeIdentifierRespiratoryRate": (10.0, 25.0),
-    }
+    torch.set_num_threads(INFERENCE_INTRA_OP_THREADS)
+
+
+@timed("normalize.series")
+def normalize_series_batch(series_batch) -> torch.Tensor:
+    """
+    (N, 3, 24) raw series, features in `SERIES_RANGES` order -> (N, 24, 3) normalized tensor.
+    """
+    import torch  # noqa: PLC0415
+
+    arr = np.asarray(series_batch, dtype=np.float32).transpose(0, 2, 1)
+    return torch.from_numpy(np.ascontiguousarray(SERIES.normalize(arr)))
 
-    keys = list(RANGES.keys())
-    normalized = []
 
-    for i, feature in enumerate(series_data):
-        min_val, max_val = RANGES[keys[i]]
-        arr = np.array(feature, dtype=np.float32)
-        norm = (arr - min_val) / (max_val - min_val + 1e-8)
-        normalized.append(norm)
+def normalize_series_data(series_data: list[list[float]]) -> torch.Tensor:
+    return normalize_series_batch([series_data])  # shape: (1, 24, 3)
 
-    return torch.tensor(normalized, dtype=torch.float32).T.unsqueeze(0)
 
 risk_mapping = [
     "Non-Alcoholic Fatty Liver Disease (NAFLD)",
@@ -40,71 +79,136 @@ risk_mapping = [
     "Systemic Inflammation-Driven Liver Stress",
 ]
 
-BLOOD_KEYS = ["ALT", "AST", "GGT", "Triglycerides", "CRP", "Ferritin"]
+BLOOD_KEYS = list(BLOOD_VALUES.keys)
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# models are loaded on first use, or up front by `warmup_models`
+models = ModelRegistry(
+    INFERENCE_BACKEND,
+    INFERENCE_EXPORT_DIR,
+    INFERENCE_INTRA_OP_THREADS,
+    INFERENCE_DEVICE,
+    INFERENCE_VARIANT,
+    ensemble=INFERENCE_ENSEMBLE,
+)
 
-blood_model = EstimateBloodAttributesNet().to(device)
-blood_model.load_state_dict(torch.load("best_blood_estimation_model.pt", map_location=device))
-blood_model.eval()
 
-risk_model = RiskScoreNet().to(device)
-risk_model.load_state_dict(torch.load("best_risk_score_model.pt", map_location=device))
-risk_model.eval()
+@timed("normalize.physical_attributes")
+def physical_attributes_tensor(physical_attributes: dict) -> torch.Tensor:
+    import torch  # noqa: PLC0415
 
+    normalized = PHYSICAL_ATTRIBUTES.normalize(PHYSICAL_ATTRIBUTES.to_array(physical_attributes))
+    return torch.from_numpy(normalized.astype(np.float32))  # shape: (6,)
 
-def evaluate_blood_values(series_data, physical_attributes: dict) -> dict:
+
+def blood_values_tensor(blood_values: dict[str, float]) -> torch.Tensor:
+    import torch  # noqa: PLC0415
+
+    normalized = BLOOD_VALUES.normalize(BLOOD_VALUES.to_array(blood_values))
+    return torch.from_numpy(normalized.astype(np.float32))  # shape: (6,)
+
+
+@timed("denormalize.blood_values")
+def denormalize_blood_batch(blood_tensor: torch.Tensor) -> torch.Tensor:
     """
-    Given physical attributes, predict blood values using a pre-trained model.
-    Assumes a dummy series input for now (can be replaced with real time-series).
+    (..., 6) normalized blood values in `BLOOD_KEYS` order -> real units, as float64.
     """
-    # Normalize input
-    normalized_attrs = normalize_physical_attributes(physical_attributes)
-    static_tensor = (
-        torch.tensor(
-            [
-                normalized_attrs["age"],
-                normalized_attrs["is_physically_active"],
-                normalized_attrs["weight"],
-                normalized_attrs["height"],
-                normalized_attrs["alcohol_consumption"],
-                normalized_attrs["is_smoker"],
-            ],
-            dtype=torch.float32,
-        )
-        .unsqueeze(0)
-        .to(device)
-    )  # shape: (1, 6)
+    return BLOOD_VALUES.denormalize(blood_tensor.double())
 
-    series_tensor = normalize_series_data(series_data).to(device)  # shape: (1, 24, 3)
 
-    print("SERIES TENSOR", series_tensor.shape)
+@timed("forward.blood_estimation")
+def predict_blood_values(series_tensor: torch.Tensor, static_tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Batched forward pass of the blood model, (B, 24, 3) x (B, 6) -> (B, 6) normalized blood values.
+    """
+    return models.get("blood_estimation")(series_tensor, static_tensor)
 
-    # Inference
-    with torch.no_grad():
-        output = blood_model(series_tensor, static_tensor)  # shape: (1, 6)
 
-    predicted_blood_values = output.squeeze(0).cpu().numpy()
+@timed("forward.risk_score")
+def predict_risk_scores(blood_tensor: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Batched forward pass of the risk model, (B, 6) -> index (B,), risks (B, 10).
+    """
+    return models.get("risk_score")(blood_tensor)
 
-    return denormalize_blood_values({BLOOD_KEYS[i]: float(predicted_blood_values[i]) for i in range(len(BLOOD_KEYS))})
 
+def predict_full(series_tensor: torch.Tensor, static_tensor: torch.Tensor) -> tuple[torch.Tensor, ...]:
+    """
+    Both models back to back on batched tensors, (B, 24, 3) x (B, 6) ->
+    blood values in real units (B, 6), index (B,), risks (B, 10).
 
-def evaluate_risk_score(blood_values: dict[str, float]) -> dict:
+    The normalized blood prediction is exactly what the risk model takes, so it's fed straight through.
     """
-    Given real (denormalized) blood values, predict index and risk vector
-    using a pre-trained RiskScoreNet.
+    blood_pred = predict_blood_values(series_tensor, static_tensor)
+    index_pred, risks_pred = predict_risk_scores(blood_pred)
+    return denormalize_blood_batch(blood_pred), index_pred, risks_pred
+
+
+@timed("forward.series_embedding")
+def embed_series(series_tensor: torch.Tensor) -> torch.Tensor:
     """
-    # Normalize input blood values
-    normalized_blood = normalize_blood_values(blood_values)
-    blood_tensor = torch.tensor([list(normalized_blood.values())], dtype=torch.float32).to(device)  # shape: (1, 6)
+    Series branch of the blood model on its own, (B, 24, 3) -> (B, 64) series embeddings.
+    """
+    return models.get("blood_estimation").run("embed_series", series_tensor)
+
+
+@timed("forward.blood_from_embedding")
+def predict_blood_from_embedding(series_embedding: torch.Tensor, static_tensor: torch.Tensor) -> torch.Tensor:
+    """
+    The rest of the blood model, (B, 64) x (B, 6) -> (B, 6) normalized blood values.
+    """
+    return models.get("blood_estimation").run("forward_from_embedding", series_embedding, static_tensor)
+
+
+def series_embeddings_supported() -> bool:
+    """
+    Whether the blood model can run its stages separately, which exported graphs and bfloat16 can't.
+    """
+    return models.get("blood_estimation").supports("embed_series")
+
+
+def predict_full_staged(
+    series_tensor: torch.Tensor,
+    static_tensor: torch.Tensor,
+    series_embedding: torch.Tensor,
+    has_embedding: torch.Tensor,
+) -> tuple[torch.Tensor, ...]:
+    """
+    `predict_full` that skips the series branch for rows with `has_embedding` (B,), using their
+    `series_embedding` (B, 64) instead. The series of those rows is ignored.
+
+    Also returns every row's (B, 64) embedding and whether it's real, which it isn't when the blood model can
+    only run as a whole.
+    """
+    import torch  # noqa: PLC0415
 
-    # Inference
-    with torch.no_grad():
-        index_pred, risks_pred = risk_model(blood_tensor)  # index: (1,), risks: (1, 10)
+    if not series_embeddings_supported():
+        blood_pred, index_pred, risks_pred = predict_full(series_tensor, static_tensor)
+        return blood_pred, index_pred, risks_pred, series_embedding, torch.zeros_like(has_embedding)
 
-    # Extract and convert
+    missing = ~has_embedding
+    if missing.any():
+        series_embedding = series_embedding.clone()
+        series_embedding[missing] = embed_series(series_tensor[missing])
+
+    blood_pred = predict_blood_from_embedding(series_embedding, static_tensor)
+    index_pred, risks_pred = predict_risk_scores(blood_pred)
+    return (
+        denormalize_blood_batch(blood_pred),
+        index_pred,
+        risks_pred,
+        series_embedding,
+        torch.ones_like(has_embedding),
+    )
+
+
+def blood_values_from_prediction(blood_values: torch.Tensor) -> dict[str, float]:
+    """(6,) blood values in real units, as returned by `predict_full`, -> API dict."""
+    return BLOOD_VALUES.to_dict(blood_values)
+
+
+def risk_score_from_prediction(index_pred: torch.Tensor, risks_pred: torch.Tensor) -> dict:
     index_score = float(index_pred.item())  # still normalized
-    risks_probs = risks_pred.squeeze(0).cpu().numpy()  # shape (10,)
+    risks_probs = risks_pred.numpy()  # shape (10,)
     risks_binary = (risks_probs > 0.5).astype(int)  # Convert to binary vector
 
     return {
@@ -113,9 +217,193 @@ def evaluate_risk_score(blood_values: dict[str, float]) -> dict:
     }
 
 
-def full_evaluation(physical_attributes: dict) -> dict:
-    blood_values = evaluate_blood_values(physical_attributes)
-    return evaluate_risk_score(blood_values)
+def evaluate_blood_values(series_data, physical_attributes: dict) -> dict:
+    """
+    Given physical attributes, predict blood values using a pre-trained model.
+    Assumes a dummy series input for now (can be replaced with real time-series).
+    """
+    static_tensor = physical_attributes_tensor(physical_attributes).unsqueeze(0)  # shape: (1, 6)
+    series_tensor = normalize_series_data(series_data)  # shape: (1, 24, 3)
+
+    output = predict_blood_values(series_tensor, static_tensor)  # shape: (1, 6)
+    return blood_values_from_prediction(denormalize_blood_batch(output.squeeze(0)))
+
+
+def evaluate_risk_score(blood_values: dict[str, float]) -> dict:
+    """
+    Given real (denormalized) blood values, predict index and risk vector
+    using a pre-trained RiskScoreNet.
+    """
+    blood_tensor = blood_values_tensor(blood_values).unsqueeze(0)  # shape: (1, 6)
+
+    index_pred, risks_pred = predict_risk_scores(blood_tensor)  # index: (1,), risks: (1, 10)
+    return risk_score_from_prediction(index_pred.squeeze(0), risks_pred.squeeze(0))
+
+
+def evaluate_series_batch(series_batch, physical_attributes: dict) -> tuple[list[dict], list[dict]]:
+    """
+    Evaluates many days of (3, 24) raw series against one set of physical attributes,
+    with a single forward pass through each model.
+    """
+    series_tensor = normalize_series_batch(series_batch)  # shape: (N, 24, 3)
+    static_tensor = physical_attributes_tensor(physical_attributes).expand(series_tensor.shape[0], -1)  # (N, 6)
+
+    blood_pred, index_pred, risks_pred = predict_full(series_tensor, static_tensor)
+
+    blood_values = [blood_values_from_prediction(row) for row in blood_pred]
+    risk_scores = [risk_score_from_prediction(index_pred[i], risks_pred[i]) for i in range(len(blood_values))]
+    return blood_values, risk_scores
+
+
+def evaluate_full(series_data, physical_attributes: dict) -> tuple[dict, dict]:
+    """
+    Blood values and risk score for one day of (3, 24) raw series, in a single pass through both models.
+    """
+    blood_values, risk_scores = evaluate_series_batch([series_data], physical_attributes)
+    return blood_values[0], risk_scores[0]
+
+
+def sweep_grid(physical_attributes: dict, axes: dict[str, list[float]]) -> np.ndarray:
+    """
+    Every combination of the axis values, with the other attributes held fixed -> (N, 6) raw physical
+    attributes in `PHYSICAL_ATTRIBUTES` order. The first axis varies slowest.
+    """
+    base = PHYSICAL_ATTRIBUTES.to_array(physical_attributes)
+    mesh = np.meshgrid(*(np.asarray(values, dtype=np.float64) for values in axes.values()), indexing="ij")
+
+    grid = np.repeat(base[np.newaxis], mesh[0].size, axis=0)
+    for key, values in zip(axes, mesh, strict=True):
+        grid[:, PHYSICAL_ATTRIBUTES.keys.index(key)] = values.ravel()
+    return grid
+
+
+def evaluate_sweep(
+    series_data,
+    physical_attributes: dict,
+    axes: dict[str, list[float]],
+    series_embedding: torch.Tensor | None = None,
+) -> tuple[dict, torch.Tensor | None]:
+    """
+    Index and risk probabilities for one day of (3, 24) raw series over a grid of physical attributes,
+    with the whole grid going through both models as a single batch.
+
+    Surfaces are nested lists shaped like the axes, in the order they were given. Also returns the day's
+    series embedding for reuse, if the blood model supports them; a given `series_embedding` stands in for
+    `series_data`.
+    """
+    import torch  # noqa: PLC0415
+
+    grid = sweep_grid(physical_attributes, axes)
+    static_tensor = torch.from_numpy(PHYSICAL_ATTRIBUTES.normalize(grid).astype(np.float32))  # shape: (N, 6)
+
+    if series_embeddings_supported():
+        # the series branch only ever needs to see the day once
+        if series_embedding is None:
+            series_embedding = embed_series(normalize_series_data(series_data)).squeeze(0)  # shape: (64,)
+        blood_pred = predict_blood_from_embedding(series_embedding.expand(len(grid), -1), static_tensor)
+        index_pred, risks_pred = predict_risk_scores(blood_pred)
+    else:
+        series_embedding = None
+        series_tensor = normalize_series_data(series_data).expand(len(grid), -1, -1)  # shape: (N, 24, 3)
+        _, index_pred, risks_pred = predict_full(series_tensor, static_tensor)
+
+    shape = [len(values) for values in axes.values()]
+    surfaces = {
+        "index": index_pred.double().reshape(shape).round(decimals=4).tolist(),
+        "risks": {
+            name: risks_pred[:, i].double().reshape(shape).round(decimals=4).tolist()
+            for i, name in enumerate(risk_mapping)
+        },
+    }
+    return surfaces, series_embedding
+
+
+async def run_inference(fn, *args):
+    """
+    Runs a blocking inference call on `inference_executor`.
+    """
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, fn, *args)
+
+
+# concurrent requests share forward passes through this
+full_batcher = MicroBatcher(
+    predict_full_staged,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    max_wait=INFERENCE_MAX_WAIT_MS / 1000,
+    executor=inference_executor,
+    name="full_model",
+)
+
+
+async def evaluate_day_batched(
+    series_data,
+    physical_attributes: dict,
+    series_embedding: torch.Tensor | None = None,
+) -> tuple[dict, dict, torch.Tensor | None]:
+    """
+    Same as `evaluate_full`, but queued onto the shared batcher. A cached `series_embedding` of the day
+    stands in for `series_data` (which may then be None) and skips the series branch.
+
+    Also returns the day's (64,) series embedding for caching, or None if the blood model can't provide one.
+    """
+    import torch  # noqa: PLC0415
+
+    from .neural_network.neural_net import EstimateBloodAttributesNet  # noqa: PLC0415
+
+    if series_embedding is None:
+        series_tensor = normalize_series_data(series_data).squeeze(0)  # shape: (24, 3)
+        series_embedding = torch.zeros(EstimateBloodAttributesNet.series_embedding_dim)
+        has_embedding = torch.tensor(data=False)
+    else:
+        series_tensor = torch.zeros(24, len(SERIES))
+        has_embedding = torch.tensor(data=True)
+    static_tensor = physical_attributes_tensor(physical_attributes)  # shape: (6,)
+
+    # includes the wait for the batch to fill up, the forward passes are timed on their own
+    with span("inference.batched"):
+        blood_pred, index_pred, risks_pred, series_embedding, is_embedding = await full_batcher.submit(
+            series_tensor,
+            static_tensor,
+            series_embedding,
+            has_embedding,
+        )
+
+    return (
+        blood_values_from_prediction(blood_pred),
+        risk_score_from_prediction(index_pred, risks_pred),
+        series_embedding.clone() if is_embedding else None,  # a row of the batch, don't keep all of it alive
+    )
+
+
+async def evaluate_full_batched(series_data, physical_attributes: dict) -> tuple[dict, dict]:
+    """
+    Same as `evaluate_full`, but queued onto the shared batcher.
+    """
+    blood_values, risk_score, _ = await evaluate_day_batched(series_data, physical_attributes)
+    return blood_values, risk_score
+
+
+def warmup_models():
+    """
+    Loads both models and runs a dummy batch through them, so a worker is fully ready before taking traffic.
+    """
+    import torch  # noqa: PLC0415
+
+    from .neural_network.neural_net import EstimateBloodAttributesNet  # noqa: PLC0415
+
+    models.warmup(
+        lambda: predict_full_staged(
+            torch.zeros(1, 24, 3),
+            torch.zeros(1, 6),
+            torch.zeros(1, EstimateBloodAttributesNet.series_embedding_dim),
+            torch.zeros(1, dtype=torch.bool),
+        ),
+    )
+
+
+def full_evaluation(series_data, physical_attributes: dict) -> dict:
+    _, risk_score = evaluate_full(series_data, physical_attributes)
+    return risk_score
 
 
 def simulate_image(organ: str, prompt: str, series: dict, index: float, risks_formatted: str) -> str:
@@ -133,8 +421,8 @@ if __name__ == "__main__":
         "is_smoker": False,
     }
 
-    blood_values = evaluate_blood_values(phsattributes)
-    print("Predicted Blood Values:", blood_values)
+    series_data = [[70.0] * 24, [200.0] * 24, [14.0] * 24]
 
-    risk_score = evaluate_risk_score(blood_values)
+    blood_values, risk_score = evaluate_full(series_data, phsattributes)
+    print("Predicted Blood Values:", blood_values)
     print("Risk Score:", risk_score)
@@ -0,0 +1,137 @@
+"""
+Exports the trained models for the faster inference backends and checks them against eager PyTorch.
+
+    python -m simulation.export [--export-dir <weights dir>/exported] [--threads 1]
+
+Writes a frozen TorchScript module and an ONNX graph per model, then prints the largest difference from the
+eager outputs and the per-call latency of every backend. Exits non-zero if any backend disagrees with eager.
+The ONNX step needs the optional onnx and onnxruntime packages and is skipped with a warning without them.
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+from .backends import MODEL_SIGNATURES
+from .backends import EagerBackend
+from .backends import OnnxRuntimeBackend
+from .backends import TorchScriptBackend
+from .backends import exported_path
+from .registry import MODEL_SPECS
+from .registry import MODEL_WEIGHTS_DIR
+from .registry import load_model
+
+PARITY_ATOL = 1e-5
+
+
+def example_inputs(model_name: str, batch_size: int = 4) -> tuple[torch.Tensor, ...]:
+    if model_name == "blood_estimation":
+        return torch.rand(batch_size, 24, 3), torch.rand(batch_size, 6)
+    return (torch.rand(batch_size, 6),)
+
+
+def export_torchscript(model: torch.nn.Module, inputs: tuple[torch.Tensor, ...], path: str | Path):
+    """Traces and freezes the model, folding its weights into the graph as constants."""
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(model.eval(), inputs))
+    torch.jit.save(frozen, str(path))
+
+
+def export_onnx(model_name: str, model: torch.nn.Module, inputs: tuple[torch.Tensor, ...], path: str | Path):
+    input_names, output_names = MODEL_SIGNATURES[model_name]
+    torch.onnx.export(
+        model.eval(),
+        inputs,
+        str(path),
+        input_names=list(input_names),
+        output_names=list(output_names),
+        dynamic_axes={name: {0: "batch"} for name in (*input_names, *output_names)},
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+def missing_onnx_packages() -> list[str]:
+    return [package for package in ("onnx", "onnxruntime") if importlib.util.find_spec(package) is None]
+
+
+def max_difference(expected, actual) -> float:
+    if not isinstance(expected, tuple):
+        expected, actual = (expected,), (actual,)
+    return max((e - a).abs().max().item() for e, a in zip(expected, actual, strict=True))
+
+
+def latency_us(backend, inputs: tuple[torch.Tensor, ...], iterations: int = 2000) -> float:
+    for _ in range(100):
+        backend(*inputs)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        backend(*inputs)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--export-dir", type=Path, default=MODEL_WEIGHTS_DIR / "exported")
+    parser.add_argument("--threads", type=int, default=1, help="intra-op threads while checking and timing")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    args.export_dir.mkdir(parents=True, exist_ok=True)
+
+    missing = missing_onnx_packages()
+    if missing:
+        print(
+            f"Skipping the ONNX export, it needs {' and '.join(missing)} (pip install onnx onnxruntime)",
+            file=sys.stderr,
+        )
+
+    report = {}
+    for model_name in MODEL_SPECS:
+        model = load_model(model_name)
+
+        device = torch.device("cpu")
+        export_torchscript(
+            model,
+            example_inputs(model_name),
+            exported_path(args.export_dir, model_name, "torchscript"),
+        )
+        backends = {
+            "eager": EagerBackend(model, device),
+            "torchscript": TorchScriptBackend(exported_path(args.export_dir, model_name, "torchscript"), device),
+        }
+
+        if not missing:
+            path = exported_path(args.export_dir, model_name, "onnxruntime")
+            export_onnx(model_name, model, example_inputs(model_name), path)
+            backends["onnxruntime"] = OnnxRuntimeBackend(path, args.threads)
+
+        report[model_name] = {}
+        for batch_size in (1, 64):
+            inputs = example_inputs(model_name, batch_size)
+            expected = backends["eager"](*inputs)
+            for name, backend in backends.items():
+                stats = report[model_name].setdefault(name, {})
+                stats[f"max_abs_diff@{batch_size}"] = max_difference(expected, backend(*inputs))
+                stats[f"latency_us@{batch_size}"] = round(latency_us(backend, inputs), 1)
+
+    print(json.dumps(report, indent=2))
+
+    mismatched = [
+        f"{model_name}/{backend}"
+        for model_name, backends in report.items()
+        for backend, stats in backends.items()
+        if any(value > PARITY_ATOL for key, value in stats.items() if key.startswith("max_abs_diff"))
+    ]
+    if mismatched:
+        print(f"Outputs differ from eager by more than {PARITY_ATOL} for: {', '.join(mismatched)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
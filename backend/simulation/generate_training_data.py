@@ -1,27 +1,40 @@
+import argparse
+import asyncio
 import json
 import os
 import random
-from datetime import datetime
+import time
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
+from aggregation import SERIES_TYPES
+from aggregation import aggregate_hourly
 from google import genai
 from google.genai import types
 from normalization import normalize_blood_values
 from normalization import normalize_physical_attributes
 from normalization import normalize_series_data
+from stub_llm import StubLLM
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=GEMINI_API_KEY)
 
+_client = None
 
-def call_gemini_json(prompt: str) -> dict:
+
+def gemini_client():
+    # created lazily so stub runs don't need an API key
+    global _client  # noqa: PLW0603
+    if _client is None:
+        _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+
+async def call_gemini_json(prompt: str) -> dict:
     """
     Sends a prompt to Gemini (PaLM) and returns parsed JSON result.
     """
 
-    response = client.models.generate_content(
+    response = await gemini_client().aio.models.generate_content(
         model="gemini-2.5-flash",
         contents=prompt,
         config=types.GenerateContentConfig(
@@ -31,7 +44,6 @@ def call_gemini_json(prompt: str) -> dict:
 
     try:
         content = response.text
-        print("Gemini response:", content)
         if "```json" in content:
             content = content.split("```json")[-1].split("```")[0].strip()
         return json.loads(content)
@@ -40,89 +52,203 @@ def call_gemini_json(prompt: str) -> dict:
         return None
 
 
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
 def group_series_data(data):
-    """Groups series data by day and type."""
-    grouped = {}
-    arr = [
-        "HKQuantityTypeIdentifierHeartRate",
-        "HKQuantityTypeIdentifierStepCount",
-        "HKQuantityTypeIdentifierRespiratoryRate",
+    """
+    Groups series data by day and type into hourly series, skipping days that can't be filled in.
+
+    Timestamps are parsed once into a datetime64 array and every day is aggregated and interpolated
+    together, see `aggregation.aggregate_hourly`.
+    """
+    records = [entry for type_ in SERIES_TYPES for entry in data[type_]["records"]["data"] if entry.get("start_date")]
+    if not records:
+        return []
+
+    days, series, valid = aggregate_hourly(
+        [entry["start_date"] for entry in records],
+        [entry["type"] for entry in records],
+        [entry["value"] for entry in records],
+        dtype=np.float64,
+    )
+
+    return [
+        {"day": str(day), "series_data": {type_: day_series[:, i].tolist() for i, type_ in enumerate(SERIES_TYPES)}}
+        for day, day_series in zip(days[valid], series[valid], strict=True)
     ]
 
-    for k in arr:
-        for entry in data[k]["records"]["data"]:
-            timestamp = entry.get("start_date")
-            if not timestamp:
-                continue
-
-            dt = datetime.fromisoformat(timestamp)
-            dt_midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            day = dt_midnight.date().isoformat()
-            hour = dt.hour % 24
-            type_ = entry["type"]
-
-            if type_ not in arr:
-                continue
-
-            if day not in grouped:
-                grouped[day] = {k: [[] for _ in range(24)] for k in arr}
-
-            grouped[day][type_][hour].append(entry["value"])
-
-    for day_entry in grouped.values():
-        for type_entry in day_entry:
-            for hour in range(24):
-                if type_entry in ["HKQuantityTypeIdentifierHeartRate", "HKQuantityTypeIdentifierRespiratoryRate"]:
-                    day_entry[type_entry][hour] = np.mean(day_entry[type_entry][hour])
-                else:
-                    day_entry[type_entry][hour] = (
-                        np.sum(day_entry[type_entry][hour]) if day_entry[type_entry][hour] else 0.0
-                    )
-
-    for day_entry in grouped.values():
-        for type_entry in day_entry:
-            if type_entry in ["HKQuantityTypeIdentifierHeartRate", "HKQuantityTypeIdentifierRespiratoryRate"]:
-                bpm = day_entry[type_entry]
-                bpm_series = pd.Series(bpm)
-
-                # Interpolate missing values linearly (forward + backward)
-                bpm_interpolated = bpm_series.interpolate(method="linear", limit_direction="both")
-
-                # Convert back to NumPy array if needed
-                bpm_filled = bpm_interpolated.to_numpy()
-
-                day_entry[type_entry] = list(bpm_filled.tolist())
-
-    # turn int64s into floats and also check for days that still have NaNs (therefore invalid)
-    def clean_day_entry(day_entry):
-        for type_entry in day_entry:
-            for i in range(len(day_entry[type_entry])):
-                if np.isnan(day_entry[type_entry][i]):
-                    return False  # Invalid day_entry
-                day_entry[type_entry][i] = float(day_entry[type_entry][i])
-        return True
-
-    for day_entry in grouped.values():
-        if not clean_day_entry(day_entry):
-            day_entry.clear()
-
-    return [{"series_data": entry} for entry in grouped.values() if entry != {}]
-
-
-def generate_training_data(series_training_data, fp):
-    i = 0
-    for entry in series_training_data:
-        print("Processing entry:", i)
-        i += 1
-        series_data = entry["series_data"]
-
-        average_bpm = float((np.mean(series_data["HKQuantityTypeIdentifierHeartRate"])) * random.uniform(0.9, 1.1))
-        average_steps = float((np.mean(series_data["HKQuantityTypeIdentifierStepCount"])) * random.uniform(0.8, 1.2))
-        average_respiratory_rate = float(
-            (np.mean(series_data["HKQuantityTypeIdentifierRespiratoryRate"])) * random.uniform(0.9, 1.1)
+
+class TrainingDataWriter:
+    """
+    Append-only JSON Lines writer for training samples.
+
+    Every sample is flushed as soon as it's written and fsynced every `fsync_every` samples, so a crash
+    loses at most the last few samples. A half-written trailing line from a crash is dropped on open.
+    """
+
+    def __init__(self, fp, fsync_every=10):
+        self.fp = Path(fp)
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+
+        truncate_partial_line(self.fp)
+        self._file = self.fp.open("a")
+
+    def write(self, sample):
+        self._file.write(json.dumps(sample) + "\n")
+        self._file.flush()
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def truncate_partial_line(fp):
+    fp = Path(fp)
+    if not fp.exists():
+        return
+
+    with fp.open("rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+
+        # walk backwards to the last complete line
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                f.truncate(pos + newline + 1)
+                return
+        f.truncate(0)
+
+
+def generated_days(fp):
+    """Days that already have a sample in the JSON Lines file at `fp`."""
+    fp = Path(fp)
+    if not fp.exists():
+        return set()
+
+    days = set()
+    with fp.open() as f:
+        for line in f:
+            try:
+                days.add(json.loads(line).get("day"))
+            except json.JSONDecodeError:
+                continue  # half-written line from a crash, it gets truncated before we append
+    return days
+
+
+async def generate_training_data(
+    series_training_data,
+    fp,
+    *,
+    llm=call_gemini_json,
+    concurrency=8,
+    rate=2.0,
+    max_retries=5,
+    progress_every=25,
+):
+    """
+    Generates one sample per series day with up to `concurrency` LLM calls in flight, started at no more than
+    `rate` per second. Failed calls and malformed answers are retried with exponential backoff.
+    Samples are appended to `fp` as they complete, so an interrupted run picks up where it left off.
+    """
+    done = generated_days(fp)
+    pending = [entry for entry in series_training_data if entry["day"] not in done]
+    print(f"Skipping {len(series_training_data) - len(pending)} already generated days")
+
+    queue = asyncio.Queue()
+    for entry in pending:
+        queue.put_nowait(entry)
+
+    bucket = TokenBucket(rate)
+    progress = {"written": 0, "failed": 0, "retries": 0}
+    start = time.monotonic()
+
+    def report():
+        finished = progress["written"] + progress["failed"]
+        elapsed = time.monotonic() - start
+        per_second = finished / elapsed if elapsed else 0.0
+        eta = (len(pending) - finished) / per_second if per_second else float("inf")
+        print(
+            f"[{finished}/{len(pending)}] {progress['written']} written, {progress['failed']} failed, "
+            f"{progress['retries']} retries | {per_second:.2f} samples/s | ETA {eta:.0f}s",
         )
 
-        prompt = f"""
+    async def worker(writer):
+        while not queue.empty():
+            entry = queue.get_nowait()
+            sample = await generate_sample(entry, llm, bucket, max_retries, progress)
+
+            if sample is None:
+                progress["failed"] += 1
+            else:
+                writer.write(sample)
+                progress["written"] += 1
+
+            if (progress["written"] + progress["failed"]) % progress_every == 0:
+                report()
+
+    with TrainingDataWriter(fp) as writer:
+        await asyncio.gather(*(worker(writer) for _ in range(concurrency)))
+
+    report()
+    return progress
+
+
+def build_prompt(series_data):
+
+    average_bpm = float((np.mean(series_data["HKQuantityTypeIdentifierHeartRate"])) * random.uniform(0.9, 1.1))
+    average_steps = float((np.mean(series_data["HKQuantityTypeIdentifierStepCount"])) * random.uniform(0.8, 1.2))
+    average_respiratory_rate = float(
+        (np.mean(series_data["HKQuantityTypeIdentifierRespiratoryRate"])) * random.uniform(0.9, 1.1),
+    )
+
+    return f"""
 Given the following three values by the user:
 
 average daily heart rate (bpm): {average_bpm}
@@ -130,7 +256,8 @@ average daily step count (steps): {average_steps}
 average respiratory rate (count/min): {average_respiratory_rate}
 
 
-Generate the following physical attribute data for a synthetic personality, try to be more healthy than not (low weight, tall, not too much alcohol, younger), but also realistic:
+Generate the following physical attribute data for a synthetic personality, try to be more healthy than not (low
+weight, tall, not too much alcohol, younger), but also realistic:
 
 age: integer between 18 and 40
 weight: float in kg (reasonable based on calories burned)
@@ -140,20 +267,27 @@ is_smoker: boolean based on alcohol consumption and BPM
 is_physically_active: boolean based on step count and BPM
 
 
-Determine a "index score" based on the values, a float that represents general health from 0 to 1. Use this index score as reference for how un/healthy the following data should be, 0 is dying and 1 is excellent health.
-The index score should have variance. The average index score should be around 0.5, but can be lower or higher based on the three variables. Try to be higher more often than not, since the provided data is an underestimation.
+Determine a "index score" based on the values, a float that represents general health from 0 to 1. Use this index score
+as reference for how un/healthy the following data should be, 0 is dying and 1 is excellent health.
+The index score should have variance. The average index score should be around 0.5, but can be lower or higher based on
+the three variables. Try to be higher more often than not, since the provided data is an underestimation.
 
-The index score is based on the health of the individual, having more weight and being older should lower the index score, while being younger and more active should increase it. Alcohol is bad. Smoking is bad. Physically active is always good.  
+The index score is based on the health of the individual, having more weight and being older should lower the index
+score, while being younger and more active should increase it. Alcohol is bad. Smoking is bad. Physically active is
+always good.
 Youth will almost always have less risk, so avoid giving them low index scores.
 
 Keep index scores reasonable, so that the following rules apply:
 - A person with an index score of 0.9 should have no risks at all.
 - A person with an index score of 0.8+ should have no risks at all.
 - A person with an index score of 0.7 should have at most one risk, and it must be mild.
-- A person with an index score of 0.6 should have at most two risks, and they should be less severe (e.g. NAFLD, ALD, or mild hepatic inflammation).
-- A person with an index score below 0.5 should have at least one risk, and it should be more severe (e.g. liver fibrosis, cirrhosis suspected).
+- A person with an index score of 0.6 should have at most two risks, and they should be less severe (e.g. NAFLD, ALD,
+  or mild hepatic inflammation).
+- A person with an index score below 0.5 should have at least one risk, and it should be more severe (e.g. liver
+  fibrosis, cirrhosis suspected).
 
-A person must not have more than 3 risks, and the risks should be realistic based on the index score. Try to diversify individuals so that the data is not too homogeneous.
+A person must not have more than 3 risks, and the risks should be realistic based on the index score. Try to diversify
+individuals so that the data is not too homogeneous.
 
 
 For example,
@@ -177,7 +311,8 @@ should have an index score of 0.9.
 }}
 should have an index score of 0.85.
 
-Once you obtain these attributes, use them alongside the original 3 variables to find suitable blood values, specifically: ALT, AST, GGT, Triglycerides, CRP, Ferritin
+Once you obtain these attributes, use them alongside the original 3 variables to find suitable blood values,
+specifically: ALT, AST, GGT, Triglycerides, CRP, Ferritin
 
 Then, from the following list of 'risks', output using its index:
 1. Non-Alcoholic Fatty Liver Disease (NAFLD)
@@ -203,54 +338,74 @@ Your output should be in the format of, and it should be valid JSON:
 Say nothing else, only output the JSON.
 """
 
-        output = call_gemini_json(prompt)
-        if not output:
-            print("Invalid output from Gemini, skipping entry")
-            continue
 
+def parse_sample(entry, output):
+    """Turns an LLM answer into a normalized training sample, raising if it's missing or malformed."""
+    if not output:
+        msg = "Invalid output from Gemini"
+        raise ValueError(msg)
+
+    return {
+        "day": entry["day"],
+        "series_data": normalize_series_data(entry["series_data"]),
+        "physical_attributes": normalize_physical_attributes(output["physical_attributes"]),
+        "blood_values": normalize_blood_values(output["blood_values"]),
+        "index": float(output["index"]),
+        "risks": [int(r) for r in output["risks"]],
+    }
+
+
+async def generate_sample(entry, llm, bucket, max_retries, progress):
+    prompt = build_prompt(entry["series_data"])
+
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
         try:
-            physical_attributes = output["physical_attributes"]
-            blood_values = output["blood_values"]
-            index = float(output["index"])
-            risks = output["risks"]
+            return parse_sample(entry, await llm(prompt))
         except Exception as e:
-            print("Error parsing Gemini output:", output, e)
-            continue
-
-        with open(fp) as f:
-            stored_training_data = json.load(f)
-            stored_training_data.append(
-                {
-                    "series_data": normalize_series_data(series_data),
-                    "physical_attributes": normalize_physical_attributes(physical_attributes),
-                    "blood_values": normalize_blood_values(blood_values),
-                    "index": index,
-                    "risks": risks,
-                },
-            )
-
-        # Save the training data to file
-        with open(fp, "w") as f:
-            json.dump(stored_training_data, f, indent=2)
+            if attempt == max_retries:
+                print(f"Giving up on {entry['day']} after {attempt + 1} attempts:", e)
+                return None
+
+            progress["retries"] += 1
+            await asyncio.sleep(min(30.0, 2**attempt) * random.uniform(0.5, 1.5))
+    return None
 
 
 if __name__ == "__main__":
     PATH_PREFIX = Path(__file__).parent.parent
-    RAW_DATA_FP = PATH_PREFIX / "data/prod_health_data.json"
-    OUTPUT_DATA_FP = PATH_PREFIX / "data/training_data.json"
 
-    with RAW_DATA_FP.open() as fp:
+    parser = argparse.ArgumentParser(description="Generate synthetic training samples for the series days.")
+    parser.add_argument("--input", type=Path, default=PATH_PREFIX / "data/prod_health_data.json")
+    parser.add_argument("--output", type=Path, default=PATH_PREFIX / "data/training_data.jsonl")
+    parser.add_argument("--limit", type=int, default=None, help="only sample this many days")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="max LLM calls started per second")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--stub", action="store_true", help="use the offline stub LLM instead of Gemini")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with args.input.open() as fp:
         data = json.load(fp)
         grouped_data = group_series_data(data)
 
     print(f"Grouped {len(grouped_data)} days of series data")
     print("Generating training data...")
 
-    with open(OUTPUT_DATA_FP, "w") as f:
-        json.dump([], f)
-
-    # Pick 10 random entries from grouped_data
-    grouped_data_sample = random.sample(grouped_data, min(100, len(grouped_data)))
-    training_data = generate_training_data(grouped_data_sample, OUTPUT_DATA_FP)
+    if args.limit is not None:
+        grouped_data = random.sample(grouped_data, min(args.limit, len(grouped_data)))
+
+    llm = StubLLM(latency=args.stub_latency) if args.stub else call_gemini_json
+    asyncio.run(
+        generate_training_data(
+            grouped_data,
+            args.output,
+            llm=llm,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            max_retries=args.max_retries,
+        ),
+    )
 
     print(":)")
@@ -0,0 +1,161 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterable
+from contextlib import contextmanager
+
+# spans cost a clock read and a lock each, turn them off to shave that off the hot path
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# seconds, from the sub-millisecond normalization steps up to slow Gemini calls
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram with one series per label value.
+
+    Observations may come from any thread, since forward passes run on the inference executor.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+
+        self._series: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # per-bucket counts (the last one being +Inf), then the sum
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> dict[str, dict]:
+        """
+        {label value: {"count", "sum", "buckets": {upper bound: cumulative count}}}
+        """
+        with self._lock:
+            series = {label_value: (list(counts), total) for label_value, (counts, total) in self._series.items()}
+
+        snapshot = {}
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                cumulative += count
+                buckets[bound] = cumulative
+            snapshot[label_value] = {"count": cumulative, "sum": total, "buckets": buckets}
+        return snapshot
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self.snapshot().items():
+            label = (self.label, label_value)
+            for bound, count in series["buckets"].items():
+                lines.append(f"{self.name}_bucket{{{_format_labels([label, ('le', _format_value(bound))])}}} {count}")
+            lines.append(f"{self.name}_sum{{{_format_labels([label])}}} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{{{_format_labels([label])}}} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+stage_durations = Histogram(
+    "terrahacks_stage_duration_seconds",
+    "Time spent in each stage of the request path.",
+    "stage",
+)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the enclosed block into `stage_durations` under `stage`, whether it raises or not.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_durations.observe(stage, time.perf_counter() - started)
+
+
+def timed(stage: str):
+    """
+    Decorator form of `span`, for both plain and async functions.
+    """
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> str:
+    """
+    Everything collected so far in the Prometheus text exposition format.
+    """
+    return stage_durations.render()
@@ -1,8 +1,21 @@
+import copy
+
 import torch
 from torch import nn
+from torch.func import functional_call
+from torch.func import stack_module_state
+from torch.func import vmap
 
 
 class EstimateBloodAttributesNet(nn.Module):
+    """
+    Runs in two stages: `embed_series` turns a day's series into an embedding that doesn't depend on the
+    physical attributes, which `forward_from_embedding` then combines with them. The embedding can therefore be
+    reused across what-ifs about the same day.
+    """
+
+    series_embedding_dim = 64
+
     def __init__(self):
         super().__init__()
 
@@ -32,18 +45,32 @@ class EstimateBloodAttributesNet(nn.Module):
             nn.Linear(64, 6),  # [ALT, AST, GGT, TRI, CRP, FERRITIN]
         )
 
-    def forward(self, series_input, static_input):
+    def embed_series(self, series_input):
         """
         series_input: (B, 24, 3)
-        static_input: (B, 6)
-        output: (64, 6)
+        output: (B, 64)
         """
         x_series = series_input.permute(0, 2, 1)  # → (B, 3, 24)
-        series_out = self.series_branch(x_series)
+        return self.series_branch(x_series)
+
+    def forward_from_embedding(self, series_embedding, static_input):
+        """
+        series_embedding: (B, 64), from `embed_series`
+        static_input: (B, 6)
+        output: (B, 6)
+        """
         static_out = self.static_branch(static_input)
-        combined = torch.cat([series_out, static_out], dim=1)
+        combined = torch.cat([series_embedding, static_out], dim=1)
         return self.combined_head(combined)
 
+    def forward(self, series_input, static_input):
+        """
+        series_input: (B, 24, 3)
+        static_input: (B, 6)
+        output: (B, 6)
+        """
+        return self.forward_from_embedding(self.embed_series(series_input), static_input)
+
 
 class RiskScoreNet(nn.Module):
     def __init__(self, blood_input_dim=6, num_risks=10):
@@ -81,3 +108,39 @@ class RiskScoreNet(nn.Module):
         index = self.index_head(features)       # (B, 1)
         risks = self.risk_head(features)        # (B, num_risks)
         return index.squeeze(1), risks          # squeeze index to (B,)
+
+
+class Ensemble(nn.Module):
+    """
+    Averages the outputs of several trained copies of one architecture, e.g. the top-k runs saved by
+    `training.py --top-k`. The members' weights are stacked so the whole ensemble is one vmapped forward pass.
+    """
+
+    def __init__(self, models):
+        super().__init__()
+        params, buffers = stack_module_state(list(models))
+        self._names = list(params) + list(buffers)
+        for i, tensor in enumerate([*params.values(), *buffers.values()]):
+            self.register_buffer(f"stacked_{i}", tensor.detach())
+
+        # only provides the structure for functional_call, so it lives on the meta device and isn't a submodule
+        self.__dict__["_base"] = copy.deepcopy(models[0]).to("meta").eval()
+
+    @classmethod
+    def from_state_dicts(cls, make_model, state_dicts):
+        models = []
+        for state_dict in state_dicts:
+            model = make_model()
+            model.load_state_dict(state_dict)
+            models.append(model.eval())
+        return cls(models)
+
+    def _member(self, stacked, *inputs):
+        return functional_call(self._base, dict(zip(self._names, stacked, strict=True)), inputs)
+
+    def forward(self, *inputs):
+        stacked = tuple(getattr(self, f"stacked_{i}") for i in range(len(self._names)))
+        outputs = vmap(self._member, in_dims=(0, *(None,) * len(inputs)))(stacked, *inputs)
+        if isinstance(outputs, tuple):
+            return tuple(output.mean(0) for output in outputs)
+        return outputs.mean(0)
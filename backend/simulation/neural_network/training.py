@@ -0,0 +1,382 @@
+import argparse
+import copy
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.func import functional_call
+from torch.func import stack_module_state
+from torch.func import vmap
+from torch.utils.data import DataLoader
+from training_data import default_training_data_path
+from training_data import load_tensorized
+
+
+@dataclass(frozen=True)
+class TrainingConfig:
+    """
+    Settings shared by every run of a training job. In ensemble mode the `runs` are the members of the stacked
+    model, member i seeded with `seed + i`.
+    """
+
+    runs: int = 10
+    seed: int = 0
+    val_fraction: float = 0.2
+    device: str = "cpu"
+    max_epochs: int = 50
+    patience: int = 5
+    batch_size: int = 32
+    lr: float = 1e-3
+    name: str = ""
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def train_val_split(num_samples, val_fraction, seed):
+    """Shuffled (train, val) index arrays. The split only depends on `seed`, so every restart sees the same one."""
+    indices = np.random.default_rng(seed).permutation(num_samples)
+    num_val = round(num_samples * val_fraction)
+    return np.sort(indices[num_val:]), np.sort(indices[:num_val])
+
+
+def batch_size_of(batch):
+    return len(next(iter(batch.values())))
+
+
+def fit(model, batch_loss, train_dataset, val_dataset, config=None):
+    """
+    Trains `model` with Adam, keeping the weights of the epoch with the lowest validation loss and stopping once it
+    hasn't improved for `config.patience` epochs. Falls back to the training loss when there's no validation data.
+
+    batch_loss(model, batch, device) -> scalar loss tensor
+    """
+    config = config or TrainingConfig()
+    device, name = config.device, config.name
+    train_loader = DataLoader(train_dataset, batch_size=config.batch_size, shuffle=True)
+    val_loader = DataLoader(val_dataset, batch_size=256) if len(val_dataset) else None
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.lr)
+
+    train_losses, val_losses = [], []
+    best_loss = float("inf")
+    best_epoch = 0
+    best_state_dict = copy.deepcopy(model.state_dict())
+
+    for epoch in range(config.max_epochs):
+        start_time = time.time()
+
+        model.train()
+        total_loss = 0.0
+        for batch in train_loader:
+            optimizer.zero_grad()
+            loss = batch_loss(model, batch, device)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+        train_losses.append(total_loss / len(train_loader))
+
+        if val_loader is not None:
+            model.eval()
+            with torch.no_grad():
+                total_loss = sum(
+                    batch_loss(model, batch, device).item() * batch_size_of(batch) for batch in val_loader
+                )
+            val_losses.append(total_loss / len(val_dataset))
+
+        epoch_loss = val_losses[-1] if val_losses else train_losses[-1]
+        elapsed = time.time() - start_time
+        print(
+            f"{name}[Epoch {epoch + 1}] Train: {train_losses[-1]:.4f} | Val: {epoch_loss:.4f} | Time: {elapsed:.2f}s",
+        )
+
+        if epoch_loss < best_loss:
+            best_loss = epoch_loss
+            best_epoch = epoch + 1
+            # state_dict() returns the live parameters, so it has to be copied to survive further training
+            best_state_dict = copy.deepcopy(model.state_dict())
+        elif epoch + 1 - best_epoch >= config.patience:
+            break
+
+    return {
+        "best_loss": best_loss,
+        "best_epoch": best_epoch,
+        "epochs": len(train_losses),
+        "train_losses": train_losses,
+        "val_losses": val_losses,
+        "state_dict": best_state_dict,
+    }
+
+
+def fit_ensemble(make_model, batch_loss, train_dataset, val_dataset, config=None):
+    """
+    Trains `config.runs` independently initialized copies of `make_model()` as one stacked model: their parameters
+    are stacked along a new leading dimension and `batch_loss` is vmapped over it, so every batch is a single
+    forward/backward pass for the whole ensemble. Member i is initialized with seed `config.seed + i`.
+
+    Adam updates each element on its own, so this is equivalent to training the members separately on the same
+    batch order. Early stopping is tracked per member and the loop ends once every member has stopped.
+    Returns one `fit`-style result per member.
+    """
+    config = config or TrainingConfig()
+    size, seed, device, name = config.runs, config.seed, config.device, config.name
+    models = []
+    for member in range(size):
+        torch.manual_seed(seed + member)
+        models.append(make_model().to(device))
+    params, buffers = stack_module_state(models)
+    base = copy.deepcopy(models[0]).to("meta")
+
+    def member_loss(params, buffers, batch):
+        def model(*inputs):
+            return functional_call(base, (params, buffers), inputs)
+
+        return batch_loss(model, batch, device)
+
+    ensemble_loss = vmap(member_loss, in_dims=(0, 0, None), randomness="different")
+
+    torch.manual_seed(seed)
+    train_loader = DataLoader(train_dataset, batch_size=config.batch_size, shuffle=True)
+    val_loader = DataLoader(val_dataset, batch_size=256) if len(val_dataset) else None
+    optimizer = torch.optim.Adam(params.values(), lr=config.lr)
+
+    train_losses, val_losses = [], []
+    best_losses = torch.full((size,), float("inf"))
+    best_epochs = torch.zeros(size, dtype=torch.long)
+    stopped_at = torch.zeros(size, dtype=torch.long)
+    best_state_dicts = [None] * size
+
+    for epoch in range(config.max_epochs):
+        start_time = time.time()
+
+        base.train()
+        total_loss = torch.zeros(size)
+        for batch in train_loader:
+            optimizer.zero_grad()
+            losses = ensemble_loss(params, buffers, batch)
+            losses.sum().backward()
+            optimizer.step()
+            total_loss += losses.detach().cpu()
+        train_losses.append(total_loss / len(train_loader))
+
+        if val_loader is not None:
+            base.eval()
+            with torch.no_grad():
+                total_loss = sum(
+                    ensemble_loss(params, buffers, batch).cpu() * batch_size_of(batch) for batch in val_loader
+                )
+            val_losses.append(total_loss / len(val_dataset))
+
+        epoch_losses = val_losses[-1] if val_losses else train_losses[-1]
+        training = stopped_at == 0
+        improved = training & (epoch_losses < best_losses)
+
+        for member in improved.nonzero().flatten().tolist():
+            best_losses[member] = epoch_losses[member]
+            best_epochs[member] = epoch + 1
+            best_state_dicts[member] = {
+                key: value[member].detach().clone() for key, value in {**params, **buffers}.items()
+            }
+
+        stopped_at[training & (epoch + 1 - best_epochs >= config.patience)] = epoch + 1
+        elapsed = time.time() - start_time
+        print(
+            f"{name}[Epoch {epoch + 1}] Best Val: {epoch_losses.min():.4f} | "
+            f"Training: {int((stopped_at == 0).sum())}/{size} | Time: {elapsed:.2f}s",
+        )
+        if (stopped_at > 0).all():
+            break
+
+    stopped_at[stopped_at == 0] = len(train_losses)
+    return [
+        {
+            "best_loss": best_losses[member].item(),
+            "best_epoch": best_epochs[member].item(),
+            "epochs": stopped_at[member].item(),
+            "train_losses": [losses[member].item() for losses in train_losses[: stopped_at[member]]],
+            "val_losses": [losses[member].item() for losses in val_losses[: stopped_at[member]]],
+            "state_dict": best_state_dicts[member],
+            "seed": seed + member,
+        }
+        for member in range(size)
+    ]
+
+
+def _init_worker(threads):
+    torch.set_num_threads(threads)
+
+
+def _run_once(train_once, corpus, train_indices, val_indices, config):
+    seed_everything(config.seed)
+    # every worker maps the same files, so the corpus sits in the page cache once however many workers there are
+    arrays = load_tensorized(corpus)
+
+    start_time = time.time()
+    result = train_once(arrays, train_indices, val_indices, replace(config, name=f"[seed {config.seed}]"))
+    result["seed"] = config.seed
+    result["wall_time"] = time.time() - start_time
+    return result
+
+
+def run_restarts(train_once, corpus=None, workers=None, config=None):
+    """
+    Trains `config.runs` independently seeded models (run i uses `config.seed + i`) across a process pool and returns
+    their results ordered by run, each with its best checkpoint. All runs share one validation split.
+
+    Workers only receive the split's row indices and read the memory-mapped corpus lazily, batch by batch.
+
+    train_once(arrays, train_indices, val_indices, config) -> `fit` result
+    """
+    config = config or TrainingConfig()
+    runs = config.runs
+    corpus = Path(corpus) if corpus is not None else default_training_data_path()
+    # converts the corpus once up front instead of racing to do it in every worker
+    num_samples = len(load_tensorized(corpus)["index"])
+    train_indices, val_indices = train_val_split(num_samples, config.val_fraction, config.seed)
+
+    workers = workers or min(runs, os.cpu_count() or 1)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    results = [None] * runs
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {
+            pool.submit(
+                _run_once,
+                train_once,
+                corpus,
+                train_indices,
+                val_indices,
+                replace(config, seed=config.seed + run),
+            ): run
+            for run in range(runs)
+        }
+        for future in as_completed(futures):
+            run = futures[future]
+            result = results[run] = future.result()
+            print(
+                f"[RUN {run + 1}/{runs}] Best Loss: {result['best_loss']:.4f} "
+                f"(epoch {result['best_epoch']}/{result['epochs']}, {result['wall_time']:.1f}s)",
+            )
+
+    return results
+
+
+def run_ensemble(train_ensemble, corpus=None, config=None):
+    """
+    `run_restarts`, but with all runs trained in this process as one stacked model (see `fit_ensemble`).
+
+    train_ensemble(arrays, train_indices, val_indices, config) -> `fit_ensemble` results
+    """
+    config = config or TrainingConfig()
+    runs = config.runs
+    corpus = Path(corpus) if corpus is not None else default_training_data_path()
+    arrays = load_tensorized(corpus)
+    train_indices, val_indices = train_val_split(len(arrays["index"]), config.val_fraction, config.seed)
+
+    start_time = time.time()
+    results = train_ensemble(arrays, train_indices, val_indices, config)
+    wall_time = time.time() - start_time
+
+    for run, result in enumerate(results):
+        # members share the wall clock, the per-run figure is its share of it
+        result["wall_time"] = wall_time / runs
+        print(
+            f"[RUN {run + 1}/{runs}] Best Loss: {result['best_loss']:.4f} "
+            f"(epoch {result['best_epoch']}/{result['epochs']})",
+        )
+
+    return results
+
+
+def top_k(results, k):
+    """The `k` best runs, best first."""
+    return sorted(results, key=lambda result: result["best_loss"])[:k]
+
+
+def write_summary(fp, results, **info):
+    best_run = min(range(len(results)), key=lambda run: results[run]["best_loss"])
+    summary = {
+        **info,
+        "best_run": best_run + 1,
+        "best_loss": results[best_run]["best_loss"],
+        "runs": [
+            {"run": run + 1, **{key: value for key, value in result.items() if key != "state_dict"}}
+            for run, result in enumerate(results)
+        ],
+    }
+    with Path(fp).open("w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(name, train_once, train_ensemble, checkpoint, defaults):
+    """
+    Command line entry point shared by the blood estimation and risk score trainers. `defaults` is the
+    `TrainingConfig` the command line options start from.
+    """
+    parser = argparse.ArgumentParser(description=f"Train the {name} model over several seeded restarts.")
+    parser.add_argument("corpus", nargs="?", type=Path, default=None, help="training data (.json, .jsonl or .tensors)")
+    parser.add_argument("--runs", type=int, default=defaults.runs)
+    parser.add_argument("--workers", type=int, default=None, help="processes to train in, defaults to one per core")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--val-fraction", type=float, default=defaults.val_fraction)
+    parser.add_argument("--max-epochs", type=int, default=defaults.max_epochs)
+    parser.add_argument("--patience", type=int, default=defaults.patience)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output", type=Path, default=Path(checkpoint))
+    parser.add_argument("--summary", type=Path, default=None, help="defaults to the checkpoint path with .json")
+    parser.add_argument("--ensemble", action="store_true", help="train all runs at once as one stacked model")
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=1,
+        help="also save the k best runs as an ensemble checkpoint (<output>_ensemble.pt), served with "
+        "INFERENCE_ENSEMBLE=true",
+    )
+    args = parser.parse_args()
+
+    print(f"[INFO] Using device: {args.device}")
+    # GPU runs would only fight over the same device
+    workers = args.workers or (1 if args.device != "cpu" else None)
+
+    config = replace(
+        defaults,
+        runs=args.runs,
+        seed=args.seed,
+        val_fraction=args.val_fraction,
+        device=args.device,
+        max_epochs=args.max_epochs,
+        patience=args.patience,
+    )
+
+    start_time = time.time()
+    if args.ensemble:
+        results = run_ensemble(train_ensemble, args.corpus, config)
+    else:
+        results = run_restarts(train_once, args.corpus, workers, config)
+
+    summary = write_summary(
+        args.summary or args.output.with_suffix(".json"),
+        results,
+        model=name,
+        mode="ensemble" if args.ensemble else "restarts",
+        seed=args.seed,
+        val_fraction=args.val_fraction,
+        wall_time=time.time() - start_time,
+    )
+    torch.save(results[summary["best_run"] - 1]["state_dict"], args.output)
+    if args.top_k > 1:
+        ensemble_path = args.output.with_name(f"{args.output.stem}_ensemble.pt")
+        torch.save([result["state_dict"] for result in top_k(results, args.top_k)], ensemble_path)
+        print(f"[INFO] Saved the top {args.top_k} runs to {ensemble_path}")
+    print(f"\n🎉 Training complete. Best overall loss: {summary['best_loss']:.4f} (run {summary['best_run']})")
@@ -0,0 +1,141 @@
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from simulation.normalization import BLOOD_VALUES
+    from simulation.normalization import PHYSICAL_ATTRIBUTES
+    from simulation.normalization import SERIES
+except ImportError:
+    # run as a script from this directory (as the trainers are), where the simulation package isn't importable
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from normalization import BLOOD_VALUES
+    from normalization import PHYSICAL_ATTRIBUTES
+    from normalization import SERIES
+
+DATA_DIR = Path("./data")
+
+# the models' feature order, shared with normalization and the server
+SERIES_KEYS = SERIES.keys
+PHYSICAL_KEYS = PHYSICAL_ATTRIBUTES.keys
+BLOOD_KEYS = BLOOD_VALUES.keys
+NUM_RISKS = 10
+
+# field -> per-sample shape, all stored as float32
+TENSOR_FIELDS = {
+    "series": (24, len(SERIES_KEYS)),
+    "physical": (len(PHYSICAL_KEYS),),
+    "blood": (len(BLOOD_KEYS),),
+    "index": (),
+    "risks": (NUM_RISKS,),
+}
+
+
+def default_training_data_path():
+    """The JSON Lines corpus written by generate_training_data, or the legacy JSON array if there isn't one yet."""
+    jsonl = DATA_DIR / "training_data.jsonl"
+    return jsonl if jsonl.exists() else DATA_DIR / "training_data.json"
+
+
+def load_training_data(fp=None):
+    """
+    Loads training samples from either a JSON Lines file (one sample per line) or a legacy JSON array.
+    """
+    fp = Path(fp) if fp is not None else default_training_data_path()
+
+    with fp.open() as f:
+        if fp.suffix != ".jsonl":
+            return json.load(f)
+
+        samples = []
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                samples.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # half-written last line from an interrupted generator run
+        return samples
+
+
+def tensorize_training_data(samples):
+    """
+    Packs samples into contiguous float32 arrays, one per field in `TENSOR_FIELDS`, with samples along axis 0.
+    Risk indices become a multi-hot vector; out of range indices are dropped.
+    """
+    arrays = {name: np.zeros((len(samples), *shape), dtype=np.float32) for name, shape in TENSOR_FIELDS.items()}
+
+    for i, sample in enumerate(samples):
+        arrays["series"][i] = np.column_stack([sample["series_data"][key] for key in SERIES_KEYS])
+        arrays["physical"][i] = [sample["physical_attributes"][key] for key in PHYSICAL_KEYS]
+        arrays["blood"][i] = [sample["blood_values"][key] for key in BLOOD_KEYS]
+        arrays["index"][i] = sample["index"]
+
+        risks = [r for r in sample["risks"] if 0 <= r < NUM_RISKS]
+        arrays["risks"][i, risks] = 1.0
+
+    return arrays
+
+
+def tensors_path(fp):
+    """Where the tensorized copy of a corpus lives: `training_data.jsonl` -> `training_data.tensors/`."""
+    return Path(fp).with_suffix(".tensors")
+
+
+def save_tensorized(arrays, directory):
+    """
+    Writes one .npy file per field. The directory is swapped in whole, so readers never see a partial conversion.
+    """
+    directory = Path(directory)
+    tmp = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    for name, array in arrays.items():
+        np.save(tmp / f"{name}.npy", np.ascontiguousarray(array, dtype=np.float32))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    tmp.rename(directory)
+
+
+def convert_training_data(fp=None):
+    """
+    One-time conversion of a JSON/JSONL corpus into its tensorized copy. Returns the directory written.
+    """
+    fp = Path(fp) if fp is not None else default_training_data_path()
+    directory = tensors_path(fp)
+    save_tensorized(tensorize_training_data(load_training_data(fp)), directory)
+    return directory
+
+
+def load_tensorized(fp=None, mmap=True):
+    """
+    Returns the `TENSOR_FIELDS` arrays for a corpus, memory-mapped by default so nothing is read until it's indexed.
+
+    `fp` may be the JSON/JSONL corpus or its `.tensors` directory. The corpus is (re)converted first
+    if it has no tensorized copy yet or has been appended to since.
+    """
+    fp = Path(fp) if fp is not None else default_training_data_path()
+    if fp.suffix == ".tensors":
+        directory = fp
+    else:
+        directory = tensors_path(fp)
+        marker = directory / "series.npy"
+        if not marker.exists() or marker.stat().st_mtime < fp.stat().st_mtime:
+            convert_training_data(fp)
+
+    # copy-on-write so torch.from_numpy gets a writable view without touching the files
+    mmap_mode = "c" if mmap else None
+    return {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in TENSOR_FIELDS}
+
+
+if __name__ == "__main__":
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else default_training_data_path()
+    directory = convert_training_data(source)
+    arrays = load_tensorized(directory)
+    print(f"[INFO] Wrote {len(arrays['index'])} samples to {directory}")
+    for name, array in arrays.items():
+        print(f"  {name}: {array.shape} {array.dtype}")
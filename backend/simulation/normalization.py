@@ -1,64 +1,104 @@
-def normalize_physical_attributes(attrs):
-    """
-    Normalize the physical_attributes dict to values between 0 and 1.
+import numpy as np
+
+
+class FeatureSpec:
     """
-    # Define min/max ranges
-    ranges = {
-        "age": (18, 40),
-        "weight": (40.0, 130.0),
-        "height": (140.0, 210.0),
-        "alcohol_consumption": (0.0, 1.0),
-    }
+    An ordered set of features with their (min, max) ranges, mapping [min, max] onto [0, 1].
 
-    return {
-        "age": (attrs["age"] - ranges["age"][0]) / (ranges["age"][1] - ranges["age"][0]),
-        "is_physically_active": float(attrs["is_physically_active"]),
-        "weight": (attrs["weight"] - ranges["weight"][0]) / (ranges["weight"][1] - ranges["weight"][0]),
-        "height": (attrs["height"] - ranges["height"][0]) / (ranges["height"][1] - ranges["height"][0]),
-        "alcohol_consumption": (attrs["alcohol_consumption"] - ranges["alcohol_consumption"][0])
-        / (ranges["alcohol_consumption"][1] - ranges["alcohol_consumption"][0]),
-        "is_smoker": float(attrs["is_smoker"]),
-    }
+    Works along the last axis of NumPy arrays or torch tensors of any batch shape, in the dtype of the input
+    (integer inputs are promoted to float64). `denormalize` is the exact inverse of `normalize`.
+    """
 
+    def __init__(self, ranges: dict[str, tuple[float, float]]):
+        self.ranges = dict(ranges)
+        self.keys = tuple(ranges)
+        self.min = np.array([low for low, _ in ranges.values()], dtype=np.float64)
+        self.scale = np.array([high - low for low, high in ranges.values()], dtype=np.float64)
 
-BLOOD_VALUES_RANGE = {
-    "ALT": (0, 100),
-    "AST": (0, 100),
-    "GGT": (0, 150),
-    "Triglycerides": (0, 400),
-    "CRP": (0, 10),
-    "Ferritin": (0, 1000),
-}
+    def __len__(self):
+        return len(self.keys)
 
+    def normalize(self, values):
+        values, low, scale = self._aligned(values)
+        return (values - low) / scale
 
-def normalize_blood_values(blood_values):
-    # Define min/max ranges
-    ranges = BLOOD_VALUES_RANGE
+    def denormalize(self, values):
+        values, low, scale = self._aligned(values)
+        return values * scale + low
 
-    return {k: (float(v) - ranges[k][0]) / (ranges[k][1] - ranges[k][0]) for k, v in blood_values.items()}
+    def to_array(self, mapping: dict) -> np.ndarray:
+        """Dict (or dict of per-hour lists) -> float64 array with the features along the last axis."""
+        return np.stack([np.asarray(mapping[key], dtype=np.float64) for key in self.keys], axis=-1)
 
+    def to_dict(self, values) -> dict:
+        """Inverse of `to_array`; a 1-D input gives plain floats, anything bigger gives nested lists."""
+        values = values.tolist()
+        if values and isinstance(values[0], list):
+            return {key: [row[i] for row in values] for i, key in enumerate(self.keys)}
+        return dict(zip(self.keys, values, strict=True))
 
-def denormalize_blood_values(normalized_blood_values):
-    # Define min/max ranges (same as in normalize)
-    ranges = BLOOD_VALUES_RANGE
+    def _aligned(self, values):
+        if isinstance(values, np.ndarray):
+            if values.dtype.kind != "f":
+                values = values.astype(np.float64)
+            return values, self.min.astype(values.dtype), self.scale.astype(values.dtype)
 
-    return {
-        k: normalized_blood_values[k] * (ranges[k][1] - ranges[k][0]) + ranges[k][0] for k in normalized_blood_values
-    }
+        # torch tensors, without making torch a dependency of this module
+        if not values.is_floating_point():
+            values = values.double()
+        return values, values.new_tensor(self.min), values.new_tensor(self.scale)
 
 
-def normalize_series_data(series_data):
-    ranges = {
+SERIES = FeatureSpec(
+    {
         "HKQuantityTypeIdentifierHeartRate": (40.0, 180.0),
         "HKQuantityTypeIdentifierStepCount": (0.0, 3000.0),
         "HKQuantityTypeIdentifierRespiratoryRate": (10.0, 25.0),
-    }
+    },
+)
+
+PHYSICAL_ATTRIBUTES = FeatureSpec(
+    {
+        "age": (18, 40),
+        "is_physically_active": (0, 1),
+        "weight": (40.0, 130.0),
+        "height": (140.0, 210.0),
+        "alcohol_consumption": (0.0, 1.0),
+        "is_smoker": (0, 1),
+    },
+)
+
+BLOOD_VALUES = FeatureSpec(
+    {
+        "ALT": (0, 100),
+        "AST": (0, 100),
+        "GGT": (0, 150),
+        "Triglycerides": (0, 400),
+        "CRP": (0, 10),
+        "Ferritin": (0, 1000),
+    },
+)
+
+
+def normalize_physical_attributes(attrs):
+    """
+    Normalize the physical_attributes dict to values between 0 and 1.
+    """
+    return PHYSICAL_ATTRIBUTES.to_dict(PHYSICAL_ATTRIBUTES.normalize(PHYSICAL_ATTRIBUTES.to_array(attrs)))
+
+
+def normalize_blood_values(blood_values):
+    return BLOOD_VALUES.to_dict(BLOOD_VALUES.normalize(BLOOD_VALUES.to_array(blood_values)))
 
-    normalized = {}
 
-    for k, values in series_data.items():
-        min_val, max_val = ranges[k]
-        normalized[k] = [(v - min_val) / (max_val - min_val) if v is not None else 0.0 for v in values]
+def denormalize_blood_values(normalized_blood_values):
+    return BLOOD_VALUES.to_dict(BLOOD_VALUES.denormalize(BLOOD_VALUES.to_array(normalized_blood_values)))
 
-    return normalized
 
+def normalize_series_data(series_data):
+    """
+    Dict of per-hour lists -> the same, normalized. Missing (None) hours become 0.
+    """
+    with np.errstate(invalid="ignore"):
+        normalized = SERIES.normalize(SERIES.to_array(series_data))
+    return SERIES.to_dict(np.nan_to_num(normalized, nan=0.0))
@@ -0,0 +1,197 @@
+"""
+Post-training int8 and bfloat16 variants of the inference models.
+
+    python -m simulation.quantization [--data <weights dir>/data/training_data.json]
+
+Calibrates the static int8 models on the training data and writes them next to the other exports, then reports
+every variant's accuracy on the training data against float32, its per-call latency and its serialized size.
+"""
+
+import argparse
+import copy
+import io
+import json
+import warnings
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from .backends import EagerBackend
+from .backends import TorchScriptBackend
+from .export import example_inputs
+from .export import latency_us
+from .neural_network.training_data import load_training_data
+from .neural_network.training_data import tensorize_training_data
+from .registry import MODEL_SPECS
+from .registry import MODEL_WEIGHTS_DIR
+from .registry import load_model
+
+VARIANTS = ("float32", "int8-dynamic", "int8-static", "bfloat16")
+
+# int8 kernels only exist on the CPU
+INT8_VARIANTS = ("int8-dynamic", "int8-static")
+
+
+class BFloat16Model(nn.Module):
+    """Runs the wrapped model in bfloat16, taking and returning float32 like every other variant."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model.to(torch.bfloat16)
+
+    def forward(self, *inputs: torch.Tensor):
+        outputs = self.model(*(tensor.to(torch.bfloat16) for tensor in inputs))
+        if isinstance(outputs, tuple):
+            return tuple(output.float() for output in outputs)
+        return outputs.float()
+
+
+def static_export_path(export_dir: str | Path, model_name: str) -> Path:
+    return Path(export_dir) / f"{model_name}.int8-static.torchscript"
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    int8 weights for the Linear layers, activations quantized on the fly. There's no dynamic int8 Conv1d,
+    so the blood model's series branch stays float32.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        from torch.ao.quantization import quantize_dynamic  # noqa: PLC0415
+
+        return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static_int8(
+    model: nn.Module,
+    calibration_batches: list[tuple[torch.Tensor, ...]],
+) -> torch.jit.ScriptModule:
+    """
+    Fully int8 model (Conv1d and Linear) with activation ranges calibrated on `calibration_batches`,
+    returned traced and frozen so it can be saved and loaded without the quantization tooling.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        from torch.ao.quantization import get_default_qconfig_mapping  # noqa: PLC0415
+        from torch.ao.quantization.quantize_fx import convert_fx  # noqa: PLC0415
+        from torch.ao.quantization.quantize_fx import prepare_fx  # noqa: PLC0415
+
+        prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(), calibration_batches[0])
+        with torch.no_grad():
+            for inputs in calibration_batches:
+                prepared(*inputs)
+            return torch.jit.freeze(torch.jit.trace(convert_fx(prepared), calibration_batches[0]))
+
+
+def make_variant(model: nn.Module, variant: str) -> nn.Module:
+    """The float32, int8-dynamic or bfloat16 variant of a loaded model; int8-static has to be exported first."""
+    if variant == "float32":
+        return model
+    if variant == "int8-dynamic":
+        return quantize_dynamic_int8(model)
+    if variant == "bfloat16":
+        return BFloat16Model(copy.deepcopy(model))
+
+    msg = f"Unknown model variant '{variant}', expected one of {', '.join(VARIANTS)}"
+    raise ValueError(msg)
+
+
+def load_variant_backend(
+    variant: str,
+    model: nn.Module,
+    model_name: str,
+    export_dir: str | Path,
+    device: torch.device,
+):
+    """
+    Backend running `variant` of a loaded float32 model: eager, or TorchScript for the calibrated int8-static
+    export, which is None if it hasn't been written yet. int8 variants always run on the CPU.
+    """
+    if variant in INT8_VARIANTS:
+        device = torch.device("cpu")
+        model = model.cpu()
+
+    if variant == "int8-static":
+        path = static_export_path(export_dir, model_name)
+        return TorchScriptBackend(path, device) if path.exists() else None
+    return EagerBackend(make_variant(model, variant), device)
+
+
+def model_inputs(model_name: str, arrays: dict) -> tuple[tuple[torch.Tensor, ...], torch.Tensor]:
+    """(inputs, targets) for a model from tensorized training data, in the normalized space the models use."""
+    if model_name == "blood_estimation":
+        inputs = (torch.from_numpy(arrays["series"]), torch.from_numpy(arrays["physical"]))
+        return inputs, torch.from_numpy(arrays["blood"])
+    return (torch.from_numpy(arrays["blood"]),), torch.from_numpy(arrays["index"])
+
+
+def serialized_size(module) -> int:
+    buffer = io.BytesIO()
+    if isinstance(module, torch.jit.ScriptModule):
+        torch.jit.save(module, buffer)
+    else:
+        torch.save(module.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def accuracy(model_name: str, outputs, reference, targets) -> dict:
+    if model_name == "blood_estimation":
+        return {
+            "mae": (outputs - targets).abs().mean().item(),
+            "mean_abs_diff_vs_float32": (outputs - reference).abs().mean().item(),
+            "max_abs_diff_vs_float32": (outputs - reference).abs().max().item(),
+        }
+
+    (index, risks), (reference_index, reference_risks) = outputs, reference
+    return {
+        "index_mae": (index - targets).abs().mean().item(),
+        "index_max_abs_diff_vs_float32": (index - reference_index).abs().max().item(),
+        "risk_flags_agreement_vs_float32": ((risks > 0.5) == (reference_risks > 0.5)).float().mean().item(),  # noqa: PLR2004
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--data", type=Path, default=MODEL_WEIGHTS_DIR / "data" / "training_data.json")
+    parser.add_argument("--export-dir", type=Path, default=MODEL_WEIGHTS_DIR / "exported")
+    parser.add_argument("--calibration-batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    args.export_dir.mkdir(parents=True, exist_ok=True)
+    arrays = tensorize_training_data(load_training_data(args.data))
+
+    report = {}
+    for model_name in MODEL_SPECS:
+        model = load_model(model_name)
+        inputs, targets = model_inputs(model_name, arrays)
+
+        batch_size = args.calibration_batch_size
+        calibration = [tuple(t[i : i + batch_size] for t in inputs) for i in range(0, len(targets), batch_size)]
+        static = quantize_static_int8(model, calibration)
+        torch.jit.save(static, str(static_export_path(args.export_dir, model_name)))
+
+        variants = {
+            "float32": model,
+            "int8-dynamic": make_variant(model, "int8-dynamic"),
+            "int8-static": static,
+            "bfloat16": make_variant(model, "bfloat16"),
+        }
+        with torch.no_grad():
+            reference = model(*inputs)
+            report[model_name] = {
+                variant: {
+                    **accuracy(model_name, module(*inputs), reference, targets),
+                    "latency_us@1": round(latency_us(module, example_inputs(model_name, 1)), 1),
+                    "latency_us@64": round(latency_us(module, example_inputs(model_name, 64)), 1),
+                    "size_bytes": serialized_size(module),
+                }
+                for variant, module in variants.items()
+            }
+
+    print(json.dumps({"samples": len(arrays["index"]), **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
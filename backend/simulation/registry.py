@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger("terrahacks-simulation.registry")
+
+# weights live next to the backend package by default, so the server doesn't depend on where it was started from
+MODEL_WEIGHTS_DIR = Path(os.getenv("MODEL_WEIGHTS_DIR", str(Path(__file__).resolve().parent.parent)))
+
+# model name -> (class in neural_net, default weights file in MODEL_WEIGHTS_DIR, env var that overrides the full path)
+MODEL_SPECS = {
+    "blood_estimation": ("EstimateBloodAttributesNet", "best_blood_estimation_model.pt", "BLOOD_MODEL_PATH"),
+    "risk_score": ("RiskScoreNet", "best_risk_score_model.pt", "RISK_MODEL_PATH"),
+}
+
+
+def model_class(model_name: str) -> type[torch.nn.Module]:
+    # resolved on use, so importing the registry doesn't import torch
+    from .neural_network import neural_net  # noqa: PLC0415
+
+    class_name, _, _ = MODEL_SPECS[model_name]
+    return getattr(neural_net, class_name)
+
+
+def weights_path(model_name: str) -> Path:
+    _, filename, env_var = MODEL_SPECS[model_name]
+    return Path(os.getenv(env_var, str(MODEL_WEIGHTS_DIR / filename)))
+
+
+def ensemble_weights_path(model_name: str) -> Path:
+    """Where `training.py --top-k` saves the best runs next to the single best model."""
+    path = weights_path(model_name)
+    return path.with_name(f"{path.stem}_ensemble.pt")
+
+
+def checkpoint_path(model_name: str, *, ensemble: bool = False) -> Path:
+    """The checkpoint `load_model` reads: the ensemble if asked for and trained, the single best model otherwise."""
+    if ensemble and ensemble_weights_path(model_name).exists():
+        return ensemble_weights_path(model_name)
+    return weights_path(model_name)
+
+
+def load_model(model_name: str, device: torch.device | str = "cpu", *, ensemble: bool = False) -> torch.nn.Module:
+    """
+    The trained model, or with `ensemble` the average of the top-k runs if they were saved. An ensemble checkpoint
+    is a list of state dicts, loaded into one `Ensemble`.
+    """
+    import torch  # noqa: PLC0415
+
+    from .neural_network.neural_net import Ensemble  # noqa: PLC0415
+
+    model_cls = model_class(model_name)
+    path = checkpoint_path(model_name, ensemble=ensemble)
+    if ensemble and path != ensemble_weights_path(model_name):
+        logger.warning("No ensemble of %s at %s (train with --top-k), using %s", model_name, path.parent, path.name)
+
+    state = torch.load(path, map_location=device)
+    if isinstance(state, list):
+        return Ensemble.from_state_dicts(model_cls, state).to(device).eval()
+
+    model = model_cls().to(device)
+    model.load_state_dict(state)
+    return model.eval()
+
+
+class ModelRegistry:
+    """
+    Loads each model (wrapped in its inference backend) on first use and keeps it for the life of the process.
+
+    Nothing touches the disk or probes for CUDA until a model is needed, so importing the simulation is cheap;
+    `warmup` loads everything ahead of time and records how long the cold start took.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        export_dir: str | Path,
+        intra_op_threads: int = 1,
+        device: str | None = None,
+        variant: str = "float32",
+        *,
+        ensemble: bool = False,
+    ):
+        self._backend = backend
+        self._variant = variant
+        self._ensemble = ensemble
+        self._export_dir = Path(export_dir)
+        self._intra_op_threads = intra_op_threads
+        self._device_name = device
+
+        self._device: torch.device | None = None
+        self._backends = {}
+        self._versions = {}
+        self._load_seconds = {}
+        self._warmup_seconds: float | None = None
+        # inference runs on a thread pool, so the first requests may race to load the same model
+        self._lock = threading.Lock()
+
+    @property
+    def device(self) -> torch.device:
+        if self._device is None:
+            import torch  # noqa: PLC0415
+
+            self._device = torch.device(self._device_name or ("cuda" if torch.cuda.is_available() else "cpu"))
+        return self._device
+
+    def get(self, model_name: str):
+        backend = self._backends.get(model_name)
+        if backend is not None:
+            return backend
+
+        with self._lock:
+            if model_name not in self._backends:
+                start = time.perf_counter()
+                self._backends[model_name] = self._load(model_name)
+                self._load_seconds[model_name] = time.perf_counter() - start
+                logger.info("Loaded %s in %.3fs", model_name, self._load_seconds[model_name])
+            return self._backends[model_name]
+
+    def version(self, model_name: str) -> str:
+        """
+        Identifies the weights and variant a model runs with, for keying anything derived from its outputs.
+        """
+        version = self._versions.get(model_name)
+        if version is None:
+            path = checkpoint_path(model_name, ensemble=self._ensemble)
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+            version = self._versions[model_name] = f"{digest}-{self._variant}"
+        return version
+
+    def _load(self, model_name: str):
+        from .backends import EagerBackend  # noqa: PLC0415
+        from .backends import load_backend  # noqa: PLC0415
+        from .neural_network.neural_net import Ensemble  # noqa: PLC0415
+
+        model = load_model(model_name, self.device, ensemble=self._ensemble)
+
+        if isinstance(model, Ensemble):
+            # exports and int8 conversions are made from the single best model, and the vmapped forward can't
+            # be traced, so ensembles only run eagerly
+            if self._backend != "eager" or self._variant not in {"float32", "bfloat16"}:
+                msg = (
+                    f"Ensembles run on the eager backend in float32 or bfloat16, "
+                    f"not {self._backend} in {self._variant}"
+                )
+                raise ValueError(msg)
+            if self._variant == "float32":
+                return EagerBackend(model, self.device)
+
+        if self._variant != "float32":
+            # the quantization tooling is only imported when a variant actually needs it
+            from .quantization import load_variant_backend  # noqa: PLC0415
+
+            backend = load_variant_backend(self._variant, model, model_name, self._export_dir, self.device)
+            if backend is not None:
+                if self._backend != "eager":
+                    logger.info(
+                        "Running the %s variant of %s, ignoring the %s backend",
+                        self._variant,
+                        model_name,
+                        self._backend,
+                    )
+                return backend
+            logger.warning(
+                "No %s export of %s in %s (run `python -m simulation.quantization`), using float32",
+                self._variant,
+                model_name,
+                self._export_dir,
+            )
+
+        return load_backend(
+            self._backend,
+            model,
+            model_name,
+            self._export_dir,
+            self.device,
+            self._intra_op_threads,
+        )
+
+    def warmup(self, forward=None):
+        """
+        Loads every model and, if given, runs `forward()` once so the first request doesn't pay for
+        lazy kernel initialization either.
+        """
+        start = time.perf_counter()
+        for model_name in MODEL_SPECS:
+            self.get(model_name)
+            self.version(model_name)
+        if forward is not None:
+            forward()
+        self._warmup_seconds = time.perf_counter() - start
+        logger.info("Models warmed up in %.3fs", self._warmup_seconds)
+
+    def ready(self) -> bool:
+        return all(model_name in self._backends for model_name in MODEL_SPECS)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready(),
+            "backend": self._backend,
+            "variant": self._variant,
+            "ensemble": self._ensemble,
+            "device": str(self._device) if self._device is not None else None,
+            "models": {
+                model_name: {
+                    "loaded": model_name in self._backends,
+                    "backend": getattr(self._backends.get(model_name), "name", None),
+                    "load_seconds": self._load_seconds.get(model_name),
+                    "version": self._versions.get(model_name),
+                }
+                for model_name in MODEL_SPECS
+            },
+            "warmup_seconds": self._warmup_seconds,
+        }
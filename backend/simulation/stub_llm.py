@@ -0,0 +1,99 @@
+import asyncio
+import random
+import re
+
+AVERAGE_PATTERNS = {
+    "bpm": re.compile(r"average daily heart rate \(bpm\): ([\d.]+)"),
+    "steps": re.compile(r"average daily step count \(steps\): ([\d.]+)"),
+}
+
+# average steps above which a sample is physically active, otherwise it still is at this rate
+ACTIVE_STEPS = 300
+ACTIVE_RATE = 0.3
+# drinkers above this alcohol consumption smoke at SMOKER_RATE and get the alcohol related risk
+HEAVY_DRINKING = 0.3
+SMOKER_RATE = 0.5
+# samples get a mild risk below the first index and a severe one below the second
+MILD_RISK_INDEX = 0.7
+SEVERE_RISK_INDEX = 0.5
+
+
+class StubLLM:
+    """
+    Offline stand-in for Gemini when generating training data.
+
+    Answers the training data prompt with plausible, loosely correlated samples after `latency` seconds,
+    and fails or returns malformed JSON at the given rates so retries get exercised too.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, malformed_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    async def __call__(self, prompt):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        roll = self._random.random()
+        if roll < self.failure_rate:
+            msg = "Stub LLM failure"
+            raise RuntimeError(msg)
+        if roll < self.failure_rate + self.malformed_rate:
+            return None
+
+        return self.sample(prompt)
+
+    def sample(self, prompt):
+        averages = {}
+        for name, pattern in AVERAGE_PATTERNS.items():
+            match = pattern.search(prompt)
+            averages[name] = float(match.group(1)) if match else 0.0
+
+        rng = self._random
+        active = averages["steps"] > ACTIVE_STEPS or rng.random() < ACTIVE_RATE
+        alcohol = round(min(1.0, rng.expovariate(8)), 2)
+        smoker = alcohol > HEAVY_DRINKING and rng.random() < SMOKER_RATE
+        height = round(rng.uniform(155, 195), 1)
+        weight = round(height - 100 + rng.uniform(-15, 25), 1)
+        age = rng.randint(18, 40)
+
+        # higher means less healthy, roughly 0 to 1
+        burden = (
+            0.4 * alcohol
+            + 0.2 * smoker
+            + 0.15 * (not active)
+            + 0.15 * max(0.0, (averages["bpm"] - 70) / 50)
+            + 0.1 * (age - 18) / 22
+        )
+        index = round(min(1.0, max(0.0, 0.95 - burden + rng.uniform(-0.1, 0.1))), 2)
+
+        risks = []
+        if index < MILD_RISK_INDEX:
+            risks.append(1 if alcohol > HEAVY_DRINKING else 0)
+        if index < SEVERE_RISK_INDEX:
+            risks.append(rng.choice([3, 4, 6, 8]))
+
+        return {
+            "physical_attributes": {
+                "age": age,
+                "is_physically_active": active,
+                "weight": weight,
+                "height": height,
+                "alcohol_consumption": alcohol,
+                "is_smoker": smoker,
+            },
+            "blood_values": {
+                "ALT": round(rng.uniform(10, 30) + 60 * burden, 1),
+                "AST": round(rng.uniform(10, 30) + 50 * burden, 1),
+                "GGT": round(rng.uniform(10, 40) + 90 * burden, 1),
+                "Triglycerides": round(rng.uniform(60, 150) + 200 * burden, 1),
+                "CRP": round(rng.uniform(0.1, 2) + 5 * burden, 2),
+                "Ferritin": round(rng.uniform(30, 200) + 300 * burden, 1),
+            },
+            "index": index,
+            "risks": risks,
+        }
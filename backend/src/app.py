@@ -1,23 +1,59 @@
 import json
 import logging
+import math
+import os
 from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 
+from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import Header
 from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-
-from simulation.eval import evaluate_blood_values
-from simulation.eval import evaluate_risk_score
-
+from pydantic import Field
+from pydantic import model_validator
+
+from simulation.eval import SERIES_RANGES
+from simulation.eval import configure_inference_threads
+from simulation.eval import evaluate_day_batched
+from simulation.eval import evaluate_series_batch
+from simulation.eval import evaluate_sweep
+from simulation.eval import full_batcher
+from simulation.eval import models
+from simulation.eval import run_inference
+from simulation.eval import warmup_models
+from simulation.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from simulation.metrics import render_metrics
+
+from .cache import attribute_rewrite_cache
+from .cache import series_embedding_cache
+from .cache import series_embedding_cache_key
+from .cache import simulation_cache
+from .cache import simulation_cache_key
+from .database import DEFAULT_USER_ID
+from .database import PHYSICAL_ATTRIBUTE_FIELDS
+from .database import SERIES_REVISION_FIELD
+from .database import day_start
 from .database import db
-from .gemini import call_gemini_json
+from .gemini import call_gemini_json_async
+from .gemini import rewrite_physical_attributes
+from .prompt_rules import prompt_rules
 
-logging.basicConfig(level=logging.INFO)
+# DEBUG also logs the inputs of every simulation, which is too much for production traffic
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+MAX_RANGE_DAYS = 366
+# every point of a sweep is a row of the same forward pass, so this bounds its memory and latency
+SWEEP_MAX_POINTS = int(os.getenv("SWEEP_MAX_POINTS", "10000"))
+# load the models before accepting requests, otherwise the first requests load them
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
 app = FastAPI()
 IMAGES_DIR = Path(__file__).parent.parent / "images"
 IMAGES_DIR.mkdir(exist_ok=True)
@@ -27,8 +63,51 @@ IMAGES_DIR.mkdir(exist_ok=True)
 app.mount("/images/", StaticFiles(directory=IMAGES_DIR), name="images")
 
 
-async def get_health_or_none():
-    return await db.physical_attributes_collection.find_one({})
+async def current_user_id(x_user_id: str = Header(default=DEFAULT_USER_ID)) -> str:
+    """
+    The header is taken at its word, there's no authentication here. Whatever sits in front of the API has to
+    authenticate callers and set (or strip) `X-User-Id` itself, otherwise anyone can act as any user.
+    """
+    return x_user_id
+
+
+async def get_health_or_none(user_id: str):
+    return await db.get_physical_attributes(user_id)
+
+
+def series_from_document(series_document: dict | None) -> list[list[float]]:
+    """
+    Pulls the (3, 24) model input out of a series document, padding short days with zeros.
+    """
+    if not series_document:
+        return [[0] * 24, [0] * 24, [0] * 24]
+
+    series_data = []
+    for key in SERIES_RANGES:
+        values = series_document[key][:24]
+        series_data.append(values + [0] * (24 - len(values)))
+    return series_data
+
+
+def series_embedding_key(user_id: str, day: datetime, series_revision: int) -> str:
+    return series_embedding_cache_key(user_id, day.date(), models.version("blood_estimation"), series_revision)
+
+
+def simulation_key(user_id: str, day: datetime, physical_attributes: dict, prompt: str, series_revision: int) -> str:
+    # results are shared between workers, which may run other weights or variants
+    data_version = f"{models.version('blood_estimation')}+{models.version('risk_score')}@{series_revision}"
+    return simulation_cache_key(user_id, day.date(), physical_attributes, prompt, data_version)
+
+
+def simulation_response(blood_values: dict, risk_score: dict) -> dict:
+    liver_sprite_index = "0" + str(9 - round(risk_score["index_score"] * 10))
+
+    return {
+        "blood_values": {k: v for k, v in blood_values.items() if k in ["ALT", "AST", "CRP"]},
+        "index": risk_score["index_score"],
+        "risks": risk_score["risks"],
+        "liver_sprite": f"/images/liver_sprite__{liver_sprite_index}.png",
+    }
 
 
 class SimulationRequest(BaseModel):
@@ -37,91 +116,172 @@ class SimulationRequest(BaseModel):
 
 
 @app.get("/get_or_simulate_day/")
-async def get_or_simulate_day(req: SimulationRequest):
-    rounded_ts = req.timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+async def get_or_simulate_day(req: SimulationRequest, user_id: str = Depends(current_user_id)):
+    rounded_ts = day_start(req.timestamp)
 
-    query = {
-        "timestamp": rounded_ts,
-    }
+    # get health
+    physical_attributes, series_revision = await db.get_physical_attributes_and_revision(user_id)
+    if not physical_attributes:
+        raise HTTPException(status_code=404, detail="Physical attributes not found")
+
+    cache_key = simulation_key(user_id, rounded_ts, physical_attributes, req.prompt, series_revision)
+    cached = await simulation_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # a cached embedding of the day stands in for its watch data, so it saves the lookup as well
+    embedding_key = series_embedding_key(user_id, rounded_ts, series_revision)
+    series_embedding = await series_embedding_cache.get(embedding_key)
+    series_data = None
+    if series_embedding is None:
+        series_document = await db.get_series_day(user_id, rounded_ts)
+        series_data = series_from_document(series_document)
+    logger.debug(
+        "Simulating day user_id=%s day=%s cached_embedding=%s series=%s",
+        user_id,
+        rounded_ts.date(),
+        series_embedding is not None,
+        series_data,
+    )
+
+    if req.prompt != "":
+        new_physical_attributes = await rewrite_physical_attributes(physical_attributes, req.prompt)
+        if not new_physical_attributes:
+            raise HTTPException(status_code=500, detail="Failed to get response from Gemini")
+    else:
+        new_physical_attributes = physical_attributes
 
-    document = await db.collection.find_one(query)
+    logger.debug("Simulating day user_id=%s physical_attributes=%s", user_id, new_physical_attributes)
 
-    if document:
-        return {
-            "timestamp": rounded_ts,
-            "evaluation": document.get("evaluation", {}),
-            "simulated": document.get("simulated", False),
-        }
+    blood_values, risk_score, day_embedding = await evaluate_day_batched(
+        series_data,
+        new_physical_attributes,
+        series_embedding,
+    )
+    if series_embedding is None and day_embedding is not None:
+        await series_embedding_cache.set(embedding_key, day_embedding)
 
-    # get health
-    # for now theres only 1 so we can just get the first one
-    result = await db.physical_attributes_collection.find_one({})
-    if not result:
+    response = simulation_response(blood_values, risk_score)
+    await simulation_cache.set(cache_key, response)
+    return response
+
+
+class RangeSimulationRequest(BaseModel):
+    start: datetime
+    end: datetime
+    prompt: str = ""
+
+
+@app.get("/simulate_range/")
+async def simulate_range(req: RangeSimulationRequest, user_id: str = Depends(current_user_id)):
+    start_ts = day_start(req.start)
+    end_ts = day_start(req.end)
+    if end_ts < start_ts:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (end_ts - start_ts).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Ranges are limited to {MAX_RANGE_DAYS} days")
+
+    physical_attributes = await db.get_physical_attributes(user_id)
+    if not physical_attributes:
         raise HTTPException(status_code=404, detail="Physical attributes not found")
 
-    physical_attributes = dict(result)
+    if req.prompt != "":
+        physical_attributes = await rewrite_physical_attributes(physical_attributes, req.prompt)
+        if not physical_attributes:
+            raise HTTPException(status_code=500, detail="Failed to get response from Gemini")
 
-    # get watch data for today
-    print(rounded_ts)
-    series_document = await db.collection.find_one({"timestamp": rounded_ts.isoformat()})
+    # one round-trip for the whole range, days without watch data are skipped
+    series_documents = await db.get_series_range(user_id, start_ts, end_ts)
 
-    if not series_document:
-        series_data = [[0]*24, [0]*24, [0]*24]
+    if series_documents:
+        series_batch = [series_from_document(document) for document in series_documents]
+        blood_values, risk_scores = await run_inference(evaluate_series_batch, series_batch, physical_attributes)
     else:
-        series_data = [
-            series_document["HKQuantityTypeIdentifierHeartRate"][:24],
-            series_document["HKQuantityTypeIdentifierStepCount"][:24],
-            series_document["HKQuantityTypeIdentifierRespiratoryRate"][:24],
-        ]
-    print("Here is my series data:", series_data)
+        blood_values, risk_scores = [], []
 
+    def stream_days():
+        for document, day_blood_values, day_risk_score in zip(
+            series_documents,
+            blood_values,
+            risk_scores,
+            strict=True,
+        ):
+            day = simulation_response(day_blood_values, day_risk_score)
+            yield json.dumps({"timestamp": document["timestamp"].isoformat(), **day}) + "\n"
 
-    if req.prompt != "":
-        prompt = f"""
-        Analyze the following prompt:
-        {req.prompt}
+    return StreamingResponse(stream_days(), media_type="application/x-ndjson")
 
-        Try to replace values in the following JSON object with values that the prompt suggests:
-        i.e. if the prompt says "I am 30 years older", then change the age in the JSON object to 30 years older.
-        {json.dumps(physical_attributes, indent=2)}
 
-        Note the following about the attributes:
-        - age: integer, in years
-        - height: float, in cm
-        - weight: float, in kg
-        - is_physically_active: boolean, true if they exercise regularly
-        - is_smoker: boolean, true if they smoke
-        - alcohol_consumption: float from 0 to 1, where 0 is no alcohol and 1 is alcohol addiction
+class SweepAxis(BaseModel):
+    start: float = Field(allow_inf_nan=False)
+    stop: float = Field(allow_inf_nan=False)
+    step: float = Field(gt=0, allow_inf_nan=False)
 
-        Take note of implicit effects, such as alcohol consumption usually means older age and a lot more weight. Height translates to age sometimes, etc.
+    @model_validator(mode="after")
+    def check_count(self) -> "SweepAxis":
+        # finite bounds can still be too far apart for their step to count, e.g. -1e308 to 1e308
+        if not math.isfinite((self.stop - self.start) / self.step):
+            msg = "Axis has too many points"
+            raise ValueError(msg)
+        return self
 
-        Return back with only the JSON object with the updated values. Do not say anything else.
-        """  # noqa: S608
+    def count(self) -> int:
+        # inclusive of `stop`, give or take float error
+        return math.floor((self.stop - self.start) / self.step + 1e-9) + 1
 
-        new_physical_attributes = call_gemini_json(prompt)
-        if not new_physical_attributes:
-            raise HTTPException(status_code=500, detail="Failed to get response from Gemini")
-    else:
-        new_physical_attributes = physical_attributes
+    def values(self) -> list[float]:
+        return [round(self.start + i * self.step, 10) for i in range(self.count())]
 
-    print("Physical attributes:", new_physical_attributes)
 
-    blood_values = evaluate_blood_values(series_data, new_physical_attributes)
-    risk_score = evaluate_risk_score(blood_values)
+class SweepRequest(BaseModel):
+    timestamp: datetime
+    axes: dict[str, SweepAxis]
 
-    liver_sprite_index = "0" + str(9 - round(risk_score["index_score"] * 10))
 
-    return {
-        "blood_values": {k: v for k, v in blood_values.items() if k in ["ALT", "AST", "CRP"]},
-        "index": risk_score["index_score"],
-        "risks": risk_score["risks"],
-        "liver_sprite": f"/images/liver_sprite__{liver_sprite_index}.png",
-    }
+@app.get("/sweep_day/")
+async def sweep_day(req: SweepRequest, user_id: str = Depends(current_user_id)):
+    """
+    Index and risk surfaces for one day over a grid of physical attributes, e.g.
+    `{"age": {"start": 18, "stop": 80, "step": 1}, "alcohol_consumption": {"start": 0, "stop": 1, "step": 0.1}}`.
+    Attributes without an axis keep their stored value.
+    """
+    if not req.axes:
+        raise HTTPException(status_code=400, detail="At least one axis is required")
+    unknown = sorted(set(req.axes) - set(PHYSICAL_ATTRIBUTE_FIELDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown physical attributes: {', '.join(unknown)}")
+    if any(axis.stop < axis.start for axis in req.axes.values()):
+        raise HTTPException(status_code=400, detail="Axes need stop >= start")
+    if math.prod(axis.count() for axis in req.axes.values()) > SWEEP_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Sweeps are limited to {SWEEP_MAX_POINTS} points")
+
+    physical_attributes, series_revision = await db.get_physical_attributes_and_revision(user_id)
+    if not physical_attributes:
+        raise HTTPException(status_code=404, detail="Physical attributes not found")
+
+    rounded_ts = day_start(req.timestamp)
+    embedding_key = series_embedding_key(user_id, rounded_ts, series_revision)
+    series_embedding = await series_embedding_cache.get(embedding_key)
+    series_data = None
+    if series_embedding is None:
+        series_data = series_from_document(await db.get_series_day(user_id, rounded_ts))
+
+    axes = {name: axis.values() for name, axis in req.axes.items()}
+    surfaces, day_embedding = await run_inference(
+        evaluate_sweep,
+        series_data,
+        physical_attributes,
+        axes,
+        series_embedding,
+    )
+    if series_embedding is None and day_embedding is not None:
+        await series_embedding_cache.set(embedding_key, day_embedding)
+    return {"axes": axes, **surfaces}
 
 
 @app.post("/summarize")
-async def summarize():
-    health = await get_health_or_none()
+async def summarize(user_id: str = Depends(current_user_id)):
+    health = await get_health_or_none(user_id)
     if not health:
         health = {}
 
@@ -140,8 +300,8 @@ async def summarize():
     }}
     """
 
-    result = call_gemini_json(prompt)
-    if "summary" in result:
+    result = await call_gemini_json_async(prompt)
+    if result and "summary" in result:
         return result
 
     return {"summary": "Failed to fetch from Gemini."}
@@ -157,29 +317,18 @@ class PhysicalAttributes(BaseModel):
 
 
 @app.get("/get-physical-attributes/")
-async def get_physical_attributes():
-    result = await db.physical_attributes_collection.find_one({})
-    if not result:
+async def get_physical_attributes(user_id: str = Depends(current_user_id)):
+    result = await db.physical_attributes_collection.find_one({"_id": user_id}, {SERIES_REVISION_FIELD: 0})
+    # ingesting series before any attributes leaves a document holding nothing but the revision
+    if not result or result.keys() <= {"_id"}:
         raise HTTPException(status_code=404, detail="Physical attributes not found")
     return dict(result)
 
 
 @app.post("/submit-physical-attributes/")
-async def submit_physical_attributes(attrs: PhysicalAttributes):
-    update_data = attrs.model_dump()
-
-    # Update the first document in the collection
-    result = await db.physical_attributes_collection.update_one(
-        {},
-        {"$set": update_data},
-    )
-
-    # Optional: Insert if nothing was matched
-    if result.matched_count == 0:
-        await db.physical_attributes_collection.insert_one(update_data)
-
-    # Return the updated document (or the inserted one)
-    updated = await db.physical_attributes_collection.find_one({})
+async def submit_physical_attributes(attrs: PhysicalAttributes, user_id: str = Depends(current_user_id)):
+    # Update the user's document, inserting it if this is their first submission
+    updated = await db.set_physical_attributes(user_id, attrs.model_dump())
     if "_id" in updated:
         updated["_id"] = str(updated["_id"])
     return {"updated": updated}
@@ -199,12 +348,43 @@ async def get_reports():
     return {"altData": [1, 2, 3, 4, 5], "bpmData": [60, 62, 61, 63, 64], "sleepData": [7, 6.5, 8, 7.5, 6]}
 
 
+@app.get("/inference-stats/")
+async def get_inference_stats():
+    return {full_batcher.name: full_batcher.stats()}
+
+
+@app.get("/ready")
+async def get_readiness():
+    stats = models.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+
+@app.get("/cache-stats/")
+async def get_cache_stats():
+    caches = (simulation_cache, attribute_rewrite_cache, series_embedding_cache)
+    return {cache.name: cache.stats() for cache in caches}
+
+
+@app.get("/prompt-stats/")
+async def get_prompt_stats():
+    return {prompt_rules.name: prompt_rules.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Connecting to the database...")
     await db.connect()
     logger.info("Database connection established.")
+    configure_inference_threads()
+    if MODEL_WARMUP:
+        await run_inference(warmup_models)
     yield
+    await full_batcher.stop()
 
 
 app.router.lifespan_context = lifespan
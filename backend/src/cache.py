@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import UTC
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from simulation.metrics import span
+
+from .database import GEMINI_CACHE_TTL_SECONDS
+from .database import RESULTS_TTL_SECONDS
+from .database import db
+
+logger = logging.getLogger("terrahacks-simulation.cache")
+
+SIMULATION_CACHE_SIZE = int(os.getenv("SIMULATION_CACHE_SIZE", "1024"))
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "4096"))
+GEMINI_CACHE_PERSIST = os.getenv("GEMINI_CACHE_PERSIST", "true").lower() == "true"
+SERIES_EMBEDDING_CACHE_SIZE = int(os.getenv("SERIES_EMBEDDING_CACHE_SIZE", "4096"))
+SERIES_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("SERIES_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+
+
+class LRUCache:
+    """
+    Small in-process LRU with an optional per-entry time-to-live.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float | None = None):
+        self._maxsize = maxsize
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        stored_at, value = entry
+        if self._ttl_seconds is not None and time.monotonic() - stored_at > self._ttl_seconds:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def hash_physical_attributes(physical_attributes: dict[str, Any]) -> str:
+    canonical = canonical_physical_attributes(physical_attributes)
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def canonical_physical_attributes(physical_attributes: dict[str, Any]) -> dict[str, Any]:
+    return {k: physical_attributes[k] for k in sorted(physical_attributes) if k != "_id"}
+
+
+def simulation_cache_key(
+    user_id: str,
+    day: date,
+    physical_attributes: dict[str, Any],
+    prompt: str,
+    data_version: str,
+) -> str:
+    """
+    `data_version` names everything else the result depends on: the model weights and the user's series revision.
+    """
+    raw = f"{user_id}|{day.isoformat()}|{hash_physical_attributes(physical_attributes)}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(f"{raw}|{data_version}".encode()).hexdigest()
+
+
+def attribute_rewrite_cache_key(template_version: int, physical_attributes: dict[str, Any], prompt: str) -> str:
+    raw = f"v{template_version}|{hash_physical_attributes(physical_attributes)}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def series_embedding_cache_key(user_id: str, day: date, model_version: str, series_revision: int) -> str:
+    raw = f"{user_id}|{day.isoformat()}|{model_version}|{series_revision}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class TieredCache:
+    """
+    Write-through cache with an in-process LRU in front of an optional Mongo collection.
+
+    The collection is looked up lazily since `db` only has collections once connected. Its `created_at`
+    TTL index takes care of eviction on the database side.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection: Callable[[], AsyncIOMotorCollection] | None,
+        maxsize: int,
+        ttl_seconds: int,
+    ):
+        self.name = name
+        self._collection = collection
+        self._ttl_seconds = ttl_seconds
+        self._lru = LRUCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
+
+        self._memory_hits = 0
+        self._mongo_hits = 0
+        self._misses = 0
+
+    async def get(self, key: str) -> Any | None:
+        result = self._lru.get(key)
+        if result is not None:
+            self._memory_hits += 1
+            return result
+
+        result = await self._get_persisted(key)
+        if result is None:
+            self._misses += 1
+            return None
+
+        self._mongo_hits += 1
+        self._lru.set(key, result)
+        return result
+
+    async def set(self, key: str, result: Any):
+        self._lru.set(key, result)
+        if self._collection is None:
+            return
+
+        try:
+            with span(f"mongo.{self.name}_cache_set"):
+                await self._collection().replace_one(
+                    {"_id": key},
+                    {"_id": key, "result": result, "created_at": datetime.now(UTC)},
+                    upsert=True,
+                )
+        except Exception:
+            # the in-process copy is still good, a failed write only costs us a recompute elsewhere
+            logger.exception("Failed to persist '%s' cache entry '%s'", self.name, key)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self._memory_hits + self._mongo_hits + self._misses
+        return {
+            "size": len(self._lru),
+            "memory_hits": self._memory_hits,
+            "mongo_hits": self._mongo_hits,
+            "misses": self._misses,
+            "hit_rate": (self._memory_hits + self._mongo_hits) / lookups if lookups else 0.0,
+        }
+
+    async def _get_persisted(self, key: str) -> Any | None:
+        if self._collection is None:
+            return None
+
+        with span(f"mongo.{self.name}_cache_get"):
+            document = await self._collection().find_one({"_id": key})
+        if not document:
+            return None
+
+        # mongo's TTL monitor only runs periodically, so double check the age here
+        created_at = document["created_at"].replace(tzinfo=UTC)
+        if datetime.now(UTC) - created_at > timedelta(seconds=self._ttl_seconds):
+            return None
+
+        return document["result"]
+
+
+simulation_cache = TieredCache(
+    "simulation_results",
+    lambda: db.results_collection,
+    maxsize=SIMULATION_CACHE_SIZE,
+    ttl_seconds=RESULTS_TTL_SECONDS,
+)
+
+attribute_rewrite_cache = TieredCache(
+    "attribute_rewrites",
+    (lambda: db.gemini_cache_collection) if GEMINI_CACHE_PERSIST else None,
+    maxsize=GEMINI_CACHE_SIZE,
+    ttl_seconds=GEMINI_CACHE_TTL_SECONDS,
+)
+
+# embeddings are tensors and cheap to recompute, so they only live in memory
+series_embedding_cache = TieredCache(
+    "series_embeddings",
+    None,
+    maxsize=SERIES_EMBEDDING_CACHE_SIZE,
+    ttl_seconds=SERIES_EMBEDDING_CACHE_TTL_SECONDS,
+)
@@ -1,19 +1,78 @@
 import json
 import logging
 import os
+import time
+from collections.abc import Iterable
+from collections.abc import Iterator
+from datetime import date
 from datetime import datetime
-import random
+from datetime import time as dt_time
+from itertools import islice
+from pathlib import Path
 from typing import Any
+from typing import BinaryIO
+from typing import TextIO
+from xml.etree import ElementTree as ET
 
 import anyio
+import numpy as np
 from motor.motor_asyncio import AsyncIOMotorClient
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from simulation.aggregation import SERIES_TYPES
+from simulation.aggregation import accumulate_hourly
+from simulation.aggregation import finalize_hourly
+from simulation.aggregation import local_days_and_hours
+from simulation.aggregation import type_indices
+from simulation.metrics import timed
 
 logger = logging.getLogger("terrahacks-simulation.db")
 
 DB_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("MONGO_DB_NAME")
 DB_COLLECTION = os.getenv("MONGO_COLLECTION_NAME")
+RESULTS_TTL_SECONDS = int(os.getenv("SIMULATION_CACHE_TTL_SECONDS", "86400"))
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "604800"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "100000"))
+
+# requests that don't say who they're for belong to this user
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "default")
+
+PHYSICAL_ATTRIBUTE_FIELDS = (
+    "age",
+    "height",
+    "weight",
+    "is_physically_active",
+    "is_smoker",
+    "alcohol_consumption",
+)
+
+# the request path only ever needs the 24 hourly values of each series type
+SERIES_PROJECTION = {"_id": 0, "user_id": 1, "timestamp": 1, **dict.fromkeys(SERIES_TYPES, 1)}
+PHYSICAL_ATTRIBUTES_PROJECTION = {"_id": 0, **dict.fromkeys(PHYSICAL_ATTRIBUTE_FIELDS, 1)}
+
+# counts a user's series writes, kept next to their attributes so request paths read both in one round-trip
+SERIES_REVISION_FIELD = "series_revision"
+
+
+def day_start(value: date | datetime) -> datetime:
+    """
+    Series days are stored as naive local midnights, whatever the offset of the device that recorded them.
+    """
+    if isinstance(value, datetime):
+        value = value.date()
+    return datetime.combine(value, dt_time.min)
+
+
+def batched(iterable: Iterable[Any], n: int) -> Iterator[list[Any]]:
+    # itertools.batched only exists from 3.12 onwards
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
 
 
 class DatabaseNotConnectedError(Exception):
@@ -33,21 +92,164 @@ class MongoDB:
         self._db_name = db_name
         self._collection_name = collection_name
         self._physical_attributes_collection_name = "physical_attributes"
+        self._results_collection_name = "simulation_results"
+        self._gemini_cache_collection_name = "gemini_cache"
 
         self._client: AsyncIOMotorClient | None = None
         self.collection: AsyncIOMotorCollection | None = None
         self.physical_attributes_collection: AsyncIOMotorCollection | None = None
+        self.results_collection: AsyncIOMotorCollection | None = None
+        self.gemini_cache_collection: AsyncIOMotorCollection | None = None
 
     async def connect(self):
         self._client = AsyncIOMotorClient(self._uri)
         db = self._client[self._db_name]
         self.collection = db[self._collection_name]
         self.physical_attributes_collection = db[self._physical_attributes_collection_name]
+        self.results_collection = db[self._results_collection_name]
+        self.gemini_cache_collection = db[self._gemini_cache_collection_name]
+
+        await self.create_indexes()
         logger.info("Connected to MongoDB '%s.%s'", self._db_name, self._collection_name)
 
-    async def populate(self, data: list[dict[str, Any]]):
-        for item in data:
-            await self.collection.insert_one(item)
+    async def create_indexes(self):
+        # cached simulation results and gemini responses expire on their own
+        await self.results_collection.create_index("created_at", expireAfterSeconds=RESULTS_TTL_SECONDS)
+        await self.gemini_cache_collection.create_index("created_at", expireAfterSeconds=GEMINI_CACHE_TTL_SECONDS)
+
+        # the single-user index would stop two users from having the same day
+        if "timestamp_1" in await self.collection.index_information():
+            await self.collection.drop_index("timestamp_1")
+
+        # physical attributes are keyed by user id through `_id`, which mongo always indexes
+        try:
+            await self.collection.create_index([("user_id", ASCENDING), ("timestamp", ASCENDING)], unique=True)
+        except OperationFailure:
+            logger.exception(
+                "Could not index series days, there are duplicate days from before they were keyed by user. "
+                "Run `python -m src.database --migrate --user-id <owner>` to hand them to their owner, "
+                "or re-ingest with --reset to drop them",
+            )
+
+    @timed("mongo.get_physical_attributes")
+    async def get_physical_attributes(self, user_id: str) -> dict[str, Any] | None:
+        return await self.physical_attributes_collection.find_one({"_id": user_id}, PHYSICAL_ATTRIBUTES_PROJECTION)
+
+    @timed("mongo.get_physical_attributes")
+    async def get_physical_attributes_and_revision(self, user_id: str) -> tuple[dict[str, Any] | None, int]:
+        """
+        A user's physical attributes (None if they have none) and how often their series have been written.
+        """
+        document = await self.physical_attributes_collection.find_one(
+            {"_id": user_id},
+            {**PHYSICAL_ATTRIBUTES_PROJECTION, SERIES_REVISION_FIELD: 1},
+        )
+        if document is None:
+            return None, 0
+        revision = document.pop(SERIES_REVISION_FIELD, 0)
+        return document or None, revision
+
+    @timed("mongo.set_physical_attributes")
+    async def set_physical_attributes(self, user_id: str, physical_attributes: dict[str, Any]) -> dict[str, Any]:
+        await self.physical_attributes_collection.update_one(
+            {"_id": user_id},
+            {"$set": physical_attributes},
+            upsert=True,
+        )
+        return await self.physical_attributes_collection.find_one({"_id": user_id}, {SERIES_REVISION_FIELD: 0})
+
+    @timed("mongo.get_series_day")
+    async def get_series_day(self, user_id: str, day: date | datetime) -> dict[str, Any] | None:
+        return await self.collection.find_one({"user_id": user_id, "timestamp": day_start(day)}, SERIES_PROJECTION)
+
+    @timed("mongo.get_series_range")
+    async def get_series_range(
+        self,
+        user_id: str,
+        start: date | datetime,
+        end: date | datetime,
+    ) -> list[dict[str, Any]]:
+        cursor = self.collection.find(
+            {"user_id": user_id, "timestamp": {"$gte": day_start(start), "$lte": day_start(end)}},
+            SERIES_PROJECTION,
+        ).sort("timestamp", ASCENDING)
+        return await cursor.to_list(length=None)
+
+    async def migrate_legacy_documents(self, user_id: str) -> dict[str, int]:
+        """
+        Hands the documents written before data was keyed by user over to `user_id`.
+
+        Series days without a `user_id` are adopted unless the user already has that day. Those duplicates are
+        dropped, and so are days still holding raw samples under an ISO string timestamp, which only a re-ingest
+        can bucket. Attributes inserted under a generated ObjectId are adopted if the user has none yet, then dropped.
+        """
+        stats = {"days_adopted": 0, "days_dropped": 0, "attributes_adopted": 0, "attributes_dropped": 0}
+
+        # {"user_id": None} also matches documents without the field
+        legacy_days = await self.collection.find({"user_id": None}, {"_id": 1, "timestamp": 1}).to_list(length=None)
+        owned_days = await self.collection.find({"user_id": user_id}, {"_id": 0, "timestamp": 1}).to_list(length=None)
+        taken = {document["timestamp"] for document in owned_days}
+
+        adopt, drop = [], []
+        for document in legacy_days:
+            timestamp = document.get("timestamp")
+            if isinstance(timestamp, datetime) and timestamp not in taken:
+                taken.add(timestamp)
+                adopt.append(document["_id"])
+            else:
+                drop.append(document["_id"])
+
+        if adopt:
+            await self.collection.update_many({"_id": {"$in": adopt}}, {"$set": {"user_id": user_id}})
+            await self.physical_attributes_collection.update_one(
+                {"_id": user_id},
+                {"$inc": {SERIES_REVISION_FIELD: 1}},
+                upsert=True,
+            )
+        if drop:
+            await self.collection.delete_many({"_id": {"$in": drop}})
+        stats["days_adopted"], stats["days_dropped"] = len(adopt), len(drop)
+
+        legacy_attributes = await self.physical_attributes_collection.find({"_id": {"$type": "objectId"}}).to_list(
+            length=None,
+        )
+        if legacy_attributes:
+            if not await self.get_physical_attributes(user_id):
+                attributes = {k: v for k, v in legacy_attributes[0].items() if k in PHYSICAL_ATTRIBUTE_FIELDS}
+                await self.set_physical_attributes(user_id, attributes)
+                stats["attributes_adopted"] = 1
+            await self.physical_attributes_collection.delete_many(
+                {"_id": {"$in": [document["_id"] for document in legacy_attributes]}},
+            )
+            stats["attributes_dropped"] = len(legacy_attributes) - stats["attributes_adopted"]
+
+        return stats
+
+    async def populate(self, data: Iterable[dict[str, Any]], batch_size: int = INGEST_BATCH_SIZE):
+        for batch in batched(data, batch_size):
+            await self.collection.insert_many(batch, ordered=False)
+
+    @timed("mongo.upsert_series_days")
+    async def upsert_series_days(self, user_id: str, documents: list[dict[str, Any]]):
+        """
+        Writes a user's per-day hourly series documents in one unordered bulk write, replacing stored days,
+        and bumps their series revision so results cached from the old days are no longer looked up.
+        """
+        operations = [
+            UpdateOne(
+                {"user_id": user_id, "timestamp": document["timestamp"]},
+                {"$set": {**document, "user_id": user_id}},
+                upsert=True,
+            )
+            for document in documents
+        ]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+            await self.physical_attributes_collection.update_one(
+                {"_id": user_id},
+                {"$inc": {SERIES_REVISION_FIELD: 1}},
+                upsert=True,
+            )
 
 
 db = MongoDB(
@@ -56,54 +258,251 @@ db = MongoDB(
     DB_COLLECTION,
 )
 
-def mongoify_raw_series(raw_data: dict[str, Any]) -> list[dict[str, Any]]:
-    grouped = {}
 
-    for entry in raw_data:
-        # Convert ISO datetime to just the date (e.g., '2020-06-13')
-        dt = datetime.fromisoformat(entry["startDate"])
-        day_str = dt.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+def _skip_whitespace(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+
+def _skip_separators(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+def _item_ended(buffer: str, end: int, *, at_eof: bool) -> bool:
+    """
+    Whether a decoded item is followed by a separator. Numbers decode from any prefix ("2." of "2.5"),
+    so an item at the end of the buffer may still continue in the next chunk.
+    """
+    after = _skip_whitespace(buffer, end)
+    if after < len(buffer) and buffer[after] in ",]":
+        return True
+    if not at_eof:
+        return False
 
-        if entry["type"] not in [
-            "HKQuantityTypeIdentifierHeartRate",
-            "HKQuantityTypeIdentifierStepCount",
-            "HKQuantityTypeIdentifierRespiratoryRate",
-        ]:
+    msg = "Truncated JSON array" if after == len(buffer) else "Malformed JSON array"
+    raise ValueError(msg)
+
+
+def iter_json_array(fp: TextIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Incrementally decodes the items of a top-level JSON array, holding at most about one chunk in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    while True:
+        chunk = fp.read(chunk_size)
+        buffer += chunk
+        pos = 0
+
+        while (pos := _skip_separators(buffer, pos)) < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    msg = "Expected a top-level JSON array"
+                    raise ValueError(msg)
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # item continues in the next chunk
+
+            if not _item_ended(buffer, end, at_eof=not chunk):
+                break
+
+            yield item
+            pos = end
+
+        buffer = buffer[pos:]
+        if not chunk:
+            # the closing bracket returns above, so getting here with an open array means it was cut off
+            if started or buffer.strip():
+                msg = "Truncated JSON array"
+                raise ValueError(msg)
+            return
+
+
+def iter_healthkit_xml(fp: BinaryIO) -> Iterator[dict[str, Any]]:
+    """
+    Streams `Record` elements out of an Apple Health `export.xml`, in the same shape as our JSON exports.
+    """
+    for _, element in ET.iterparse(fp, events=("end",)):  # noqa: S314
+        if element.tag == "Record" and element.get("type") in SERIES_TYPES:
+            try:
+                yield {
+                    "type": element.get("type"),
+                    "startDate": datetime.strptime(element.get("startDate"), "%Y-%m-%d %H:%M:%S %z").isoformat(),
+                    "value": float(element.get("value")),
+                }
+            except (TypeError, ValueError):
+                logger.warning("Skipping malformed record: %s", element.attrib)
+
+        # records have no children we care about, so drop everything we've seen so far
+        if element.tag != "HealthData":
+            element.clear()
+
+
+def iter_raw_records(path: Path) -> Iterator[dict[str, Any]]:
+    if path.suffix == ".xml":
+        with path.open("rb") as fp:
+            yield from iter_healthkit_xml(fp)
+    else:
+        with path.open() as fp:
+            yield from iter_json_array(fp)
+
+
+def aggregate_raw_series(
+    records: Iterable[dict[str, Any]],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    stats: dict[str, float] | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Buckets raw records into one document per day holding 24 hourly values per series type.
+
+    Records are consumed `chunk_size` at a time through the shared vectorized aggregation, and only
+    fixed-size (24, 3) sums and counts are kept per day, so memory no longer grows with the export.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("records", 0)
+
+    day_slots: dict[np.datetime64, int] = {}
+    sums = np.zeros((0, 24, len(SERIES_TYPES)))
+    counts = np.zeros((0, 24, len(SERIES_TYPES)), dtype=np.intp)
+
+    for chunk in batched(records, chunk_size):
+        stats["records"] += len(chunk)
+        chunk = [entry for entry in chunk if entry["type"] in SERIES_TYPES]  # noqa: PLW2901
+        if not chunk:
             continue
 
-        if day_str not in grouped:
-            # respiratory data not present in sample population
-            grouped[day_str] = {"HKQuantityTypeIdentifierHeartRate": [], "HKQuantityTypeIdentifierStepCount": [], "HKQuantityTypeIdentifierRespiratoryRate": [random.uniform(10.0, 13.0) for _ in range(24)]}
+        days, hours = local_days_and_hours([entry["startDate"] for entry in chunk])
+        keys, day_indices = np.unique(days, return_inverse=True)
+
+        chunk_sums, chunk_counts = accumulate_hourly(
+            day_indices,
+            hours,
+            type_indices([entry["type"] for entry in chunk]),
+            np.array([entry["value"] for entry in chunk], dtype=np.float64),
+            len(keys),
+        )
+
+        slots = np.array([day_slots.setdefault(key, len(day_slots)) for key in keys])
+        if len(day_slots) > len(sums):
+            grow = len(day_slots) - len(sums)
+            sums = np.concatenate([sums, np.zeros((grow, *sums.shape[1:]))])
+            counts = np.concatenate([counts, np.zeros((grow, *counts.shape[1:]), dtype=np.intp)])
+        sums[slots] += chunk_sums
+        counts[slots] += chunk_counts
+
+    # respiratory data not present in sample population
+    respiratory = SERIES_TYPES.index("HKQuantityTypeIdentifierRespiratoryRate")
+    missing = counts[:, :, respiratory].sum(axis=1) == 0
+    sums[missing, :, respiratory] = np.random.default_rng().uniform(10.0, 13.0, size=(int(missing.sum()), 24))
+    counts[missing, :, respiratory] = 1
+
+    series, valid = finalize_hourly(sums, counts)
+    if not valid.all():
+        logger.warning("Skipping %d days without any heart rate samples", int((~valid).sum()))
+
+    documents = []
+    for key, slot in sorted(day_slots.items()):
+        if valid[slot]:
+            document = {"timestamp": day_start(key.item())}
+            document.update({k: series[slot, :, i].tolist() for i, k in enumerate(SERIES_TYPES)})
+            documents.append(document)
+    return documents
 
-        # Append value to correct type and date
-        grouped[day_str][entry["type"]].append(entry["value"])
 
-    # Convert to desired output format
-    result = []
-    for day, data in grouped.items():
-        out = {"timestamp": day}
-        out.update(data)
-        result.append(out)
+def mongoify_raw_series(raw_data: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+    return aggregate_raw_series(raw_data)
+
+
+async def ingest_raw_series(
+    user_id: str,
+    records: Iterable[dict[str, Any]],
+    batch_size: int = INGEST_BATCH_SIZE,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+) -> dict[str, float]:
+    """
+    Streams a user's raw records through the hourly aggregation and into the series collection
+    with batched, unordered bulk upserts.
+    """
+    stats = {"records": 0, "days": 0}
+
+    start = time.perf_counter()
+    documents = aggregate_raw_series(records, chunk_size, stats)
+    logger.info("Aggregated %d records into %d days", stats["records"], len(documents))
+
+    for batch in batched(documents, batch_size):
+        await db.upsert_series_days(user_id, batch)
+        stats["days"] += len(batch)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["records_per_second"] = stats["records"] / stats["seconds"] if stats["seconds"] else 0.0
+    logger.info(
+        "Ingested %d records into %d day documents in %.1fs (%.0f records/s)",
+        stats["records"],
+        stats["days"],
+        stats["seconds"],
+        stats["records_per_second"],
+    )
+    return stats
 
-    return result
 
 if __name__ == "__main__":
+    import argparse
     import asyncio
 
+    parser = argparse.ArgumentParser(description="Load a raw HealthKit export (JSON array or export.xml) into Mongo.")
+    parser.add_argument("path", nargs="?", type=Path, default=Path("./data/raw_series_data.json"))
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--user-id", default=DEFAULT_USER_ID, help="user the export and sample attributes belong to")
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="drop the user's existing series documents, and any not keyed by user yet, first",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="hand documents from before data was keyed by user over to --user-id instead of ingesting",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
     async def main():
         await db.connect()
         logger.info("Database connected successfully.")
 
-        async with await anyio.open_file("./data/raw_series_data.json", "r") as fp:
-            raw_data = json.loads(await fp.read())
-            schema = mongoify_raw_series(raw_data)
-        await db.populate(schema)
+        if args.migrate:
+            stats = await db.migrate_legacy_documents(args.user_id)
+            logger.info("Migrated legacy documents to '%s': %s", args.user_id, stats)
+            # the unique index couldn't be built while there were duplicate days, try again now they're gone
+            await db.create_indexes()
+            return
+
+        if args.reset:
+            # {"user_id": None} also matches legacy documents without the field
+            await db.collection.delete_many({"user_id": {"$in": [args.user_id, None]}})
+            await db.create_indexes()
+        await ingest_raw_series(args.user_id, iter_raw_records(args.path), args.batch_size, args.chunk_size)
 
         async with await anyio.open_file("./data/sample_physical_data.json", "r") as fp:
             sample_physical_data = json.loads(await fp.read())
+            sample_physical_data.pop("_id", None)
 
-            await db.physical_attributes_collection.delete_many({})
-            await db.physical_attributes_collection.insert_one(sample_physical_data)
+            await db.set_physical_attributes(args.user_id, sample_physical_data)
             logger.info("Database populated with initial data.")
 
     asyncio.run(main())
@@ -1,34 +1,145 @@
-
+import asyncio
 import json
+import logging
 import os
 
 from google import genai
 from google.genai import types
 
+from simulation.metrics import span
+
+from .cache import attribute_rewrite_cache
+from .cache import attribute_rewrite_cache_key
+from .cache import canonical_physical_attributes
+from .prompt_rules import clamp_physical_attributes
+from .prompt_rules import prompt_rules
+
+logger = logging.getLogger("terrahacks-simulation.gemini")
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# bump whenever `attribute_rewrite_prompt` or the handling of its answer changes so stale cached rewrites are
+# never served
+ATTRIBUTE_REWRITE_PROMPT_VERSION = 2
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+# caps the number of in-flight requests per worker so a burst can't exhaust our quota
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
 
-def call_gemini_json(prompt: str) -> dict:
-    """
-    Sends a prompt to Gemini (PaLM) and returns parsed JSON result.
-    """
+GENERATE_CONFIG = types.GenerateContentConfig(
+    thinking_config=types.ThinkingConfig(thinking_budget=512),
+)
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(thinking_budget=512),
-        ),
-    )
 
+def parse_gemini_json(content: str | None) -> dict | None:
+    """
+    Pulls the JSON object out of a Gemini response, which may or may not be wrapped in a ```json fence.
+    """
+    logger.debug("Gemini response content=%r", content)
     try:
-        content = response.text
-        print("Gemini response:", content)
         if "```json" in content:
             content = content.split("```json")[-1].split("```")[0].strip()
         return json.loads(content)
     except Exception as e:
-        print("Error parsing Gemini response:", content, e)
+        logger.warning("Could not parse Gemini response content=%r error=%s", content, e)
+        return None
+
+
+def call_gemini_json(prompt: str) -> dict:
+    """
+    Sends a prompt to Gemini (PaLM) and returns parsed JSON result.
+    """
+
+    with span("gemini.generate_content"):
+        response = client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=GENERATE_CONFIG,
+        )
+
+    return parse_gemini_json(response.text)
+
+
+async def call_gemini_json_async(prompt: str, timeout: float = GEMINI_TIMEOUT_SECONDS) -> dict | None:
+    """
+    Non-blocking `call_gemini_json`, bounded by `gemini_semaphore` and a per-call timeout.
+    Returns None when Gemini times out, fails or responds with something that isn't JSON.
+    """
+    async with gemini_semaphore:
+        try:
+            with span("gemini.generate_content"):
+                response = await asyncio.wait_for(
+                    client.aio.models.generate_content(
+                        model=GEMINI_MODEL,
+                        contents=prompt,
+                        config=GENERATE_CONFIG,
+                    ),
+                    timeout=timeout,
+                )
+        except TimeoutError:
+            logger.warning("Gemini call timed out after %.1fs", timeout)
+            return None
+        except Exception:
+            logger.exception("Gemini call failed")
+            return None
+
+    return parse_gemini_json(response.text)
+
+
+def attribute_rewrite_prompt(physical_attributes: dict, user_prompt: str) -> str:
+    return f"""
+        Analyze the following prompt:
+        {user_prompt}
+
+        Try to replace values in the following JSON object with values that the prompt suggests:
+        i.e. if the prompt says "I am 30 years older", then change the age in the JSON object to 30 years older.
+        {json.dumps(physical_attributes, indent=2)}
+
+        Note the following about the attributes:
+        - age: integer, in years
+        - height: float, in cm
+        - weight: float, in kg
+        - is_physically_active: boolean, true if they exercise regularly
+        - is_smoker: boolean, true if they smoke
+        - alcohol_consumption: float from 0 to 1, where 0 is no alcohol and 1 is alcohol addiction
+
+        Take note of implicit effects, such as alcohol consumption usually means older age and a lot more weight. Height translates to age sometimes, etc.
+
+        Return back with only the JSON object with the updated values. Do not say anything else.
+        """  # noqa: S608, E501
+
+
+async def rewrite_physical_attributes(physical_attributes: dict, user_prompt: str) -> dict | None:
+    """
+    Applies a "what if" prompt to the physical attributes, locally through `prompt_rules` when it can,
+    otherwise by asking Gemini. Either way the result is clamped to the ranges the models were trained on.
+    Gemini rewrites are memoized on the prompt template version, the attributes and the normalized prompt.
+    """
+    rewritten = prompt_rules.rewrite(physical_attributes, user_prompt)
+    if rewritten is not None:
+        return rewritten
+
+    physical_attributes = canonical_physical_attributes(physical_attributes)
+    key = attribute_rewrite_cache_key(ATTRIBUTE_REWRITE_PROMPT_VERSION, physical_attributes, user_prompt)
+
+    cached = await attribute_rewrite_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rewritten = await call_gemini_json_async(attribute_rewrite_prompt(physical_attributes, user_prompt))
+    if not rewritten:
         return None
+
+    try:
+        # attributes Gemini left out keep their current values
+        rewritten = clamp_physical_attributes({**physical_attributes, **rewritten})
+    except TypeError:
+        logger.warning("Gemini rewrote the physical attributes into something unusable: %r", rewritten)
+        return None
+
+    await attribute_rewrite_cache.set(key, rewritten)
+    return rewritten
@@ -0,0 +1,270 @@
+import logging
+import os
+import re
+from collections.abc import Callable
+from typing import Any
+
+from simulation.normalization import PHYSICAL_ATTRIBUTES
+
+from .cache import canonical_physical_attributes
+from .cache import normalize_prompt
+
+logger = logging.getLogger("terrahacks-simulation.prompt-rules")
+
+# answer simple "what if" prompts locally, only asking Gemini about the ones the rules don't understand
+PROMPT_RULES_ENABLED = os.getenv("PROMPT_RULES_ENABLED", "true").lower() == "true"
+
+NUMBER_WORDS = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+    "fifteen": 15,
+    "twenty": 20,
+    "thirty": 30,
+    "forty": 40,
+}
+
+KG_PER_UNIT = {
+    **dict.fromkeys(("kg", "kgs", "kilo", "kilos", "kilogram", "kilograms"), 1.0),
+    **dict.fromkeys(("lb", "lbs", "pound", "pounds"), 0.45359237),
+}
+CM_PER_UNIT = {
+    **dict.fromkeys(("cm", "centimeter", "centimeters", "centimetre", "centimetres"), 1.0),
+    **dict.fromkeys(("m", "meter", "meters", "metre", "metres"), 100.0),
+}
+
+# alcohol_consumption goes from 0 (none) to 1 (addiction)
+ALCOHOL_OCCASIONAL = 0.2
+ALCOHOL_SOCIAL = 0.3
+ALCOHOL_REGULAR = 0.5
+ALCOHOL_HEAVY = 0.8
+ALCOHOL_ADDICTED = 1.0
+ALCOHOL_STEP = 0.2
+
+DRINKING_FREQUENCIES = (
+    (re.compile(r"heavily|a lot|too much|every day|daily|excessively"), ALCOHOL_HEAVY),
+    (re.compile(r"socially|weekends?|sometimes|a little|a bit"), ALCOHOL_SOCIAL),
+    (re.compile(r"occasionally|rarely|once in a while"), ALCOHOL_OCCASIONAL),
+)
+
+
+def _alternatives(words) -> str:
+    # longest first, so "kg" doesn't win over "kgs"
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+KG_UNITS = _alternatives(KG_PER_UNIT)
+NUMBER = rf"(?P<amount>\d+(?:\.\d+)?|{_alternatives(NUMBER_WORDS)})"
+WEIGHT = rf"{NUMBER} ?(?P<unit>{KG_UNITS})"
+HEIGHT = rf"{NUMBER} ?(?P<unit>{_alternatives(CM_PER_UNIT)})"
+
+# prompts are lowercased and whitespace-collapsed by `normalize_prompt` first, so single spaces suffice
+LEAD = (
+    r"(?:(?:what if|what happens if|what would happen if|imagine|imagine if|suppose|pretend|assume|if|say) )?"
+    r"(?:that )?"
+)
+TAIL = r"(?: (?:now|instead|from now on|anymore|any more|for good|completely|too|as well))*"
+I_AM = r"(?:i ?'?m|i am|i was|i were|i (?:would|will|'d|'ll) be|i (?:became|become|got|get)) "
+I_DO = r"(?:i (?:would |will |'d |'ll |did |do |had |have |'ve )?)"
+NOT = r"(?:don't|do not|didn't|did not|never|no longer|wouldn't|would not) "
+QUIT = r"(?:quit|stop|stopped|gave up|give up|cut out) "
+START = r"(?:start|started|began|begin|took up|take up|picked up|pick up) "
+EXERCISE = r"(?:exercising|exercise|working out|running|going to the gym|the gym|sports?)"
+DRINKING = r"(?:drinking|drinking alcohol|alcohol|booze)"
+DRINKING_FREQUENCY = (
+    r"(?: (?P<frequency>heavily|a lot|too much|every day|daily|excessively|socially|on (?:the )?weekends|"
+    r"every weekend|sometimes|a little|a bit|occasionally|rarely|once in a while|regularly|often|moderately))?"
+)
+
+# splits a prompt into clauses, leaving decimal points alone
+CLAUSE_SEPARATOR = re.compile(r" ?(?:[,;!?]+|\.(?!\d)| and | but | then | also |^and |^but |^also |^so ) ?")
+
+Rule = Callable[[dict[str, Any], re.Match], None]
+
+
+def _amount(match: re.Match, units: dict[str, float] | None = None) -> float:
+    raw = match["amount"]
+    amount = float(NUMBER_WORDS.get(raw, raw))
+    if units is not None and match["unit"]:
+        amount *= units[match["unit"]]
+    return amount
+
+
+def shift(key: str, sign: float = 1.0, units: dict[str, float] | None = None) -> Rule:
+    def rule(attrs, match):
+        attrs[key] += sign * _amount(match, units)
+
+    return rule
+
+
+def assign(key: str, units: dict[str, float] | None = None) -> Rule:
+    def rule(attrs, match):
+        attrs[key] = _amount(match, units)
+
+    return rule
+
+
+def constant(key: str, value: Any) -> Rule:
+    def rule(attrs, _match):
+        attrs[key] = value
+
+    return rule
+
+
+def drink(attrs, match):
+    frequency = match["frequency"] or ""
+    attrs["alcohol_consumption"] = next(
+        (level for pattern, level in DRINKING_FREQUENCIES if pattern.search(frequency)),
+        ALCOHOL_REGULAR,
+    )
+
+
+def drink_more_or_less(attrs, match):
+    attrs["alcohol_consumption"] += ALCOHOL_STEP if match["direction"] == "more" else -ALCOHOL_STEP
+
+
+RULES: tuple[tuple[re.Pattern, Rule], ...] = tuple(
+    (re.compile(LEAD + pattern + TAIL), rule)
+    for pattern, rule in (
+        # age
+        (rf"(?:{I_AM})?{NUMBER} years? older", shift("age")),
+        (rf"(?:{I_AM})?{NUMBER} years? younger", shift("age", -1)),
+        (rf"(?:in )?{NUMBER} years? (?:later|from now|in the future|have passed|passed)", shift("age")),
+        (rf"in {NUMBER} years?(?: time)?", shift("age")),
+        (rf"(?:{I_AM}|my age is |i turn |i turned ){NUMBER}(?: years? old| yo)?", assign("age")),
+        # weight
+        (rf"(?:{I_DO})?(?:lost|lose|dropped|drop|shed) {WEIGHT}", shift("weight", -1, KG_PER_UNIT)),
+        (rf"(?:{I_DO})?(?:gained|gain|put on) {WEIGHT}", shift("weight", 1, KG_PER_UNIT)),
+        (rf"(?:{I_AM})?{WEIGHT} heavier", shift("weight", 1, KG_PER_UNIT)),
+        (rf"(?:{I_AM})?{WEIGHT} lighter", shift("weight", -1, KG_PER_UNIT)),
+        (rf"(?:i weigh |i weighed |my weight is ){NUMBER}(?: ?(?P<unit>{KG_UNITS}))?", assign("weight", KG_PER_UNIT)),
+        # height
+        (rf"(?:{I_AM})?{HEIGHT} taller", shift("height", 1, CM_PER_UNIT)),
+        (rf"(?:{I_AM})?{HEIGHT} shorter", shift("height", -1, CM_PER_UNIT)),
+        (rf"(?:{I_AM}|my height is ){HEIGHT}(?: tall)?", assign("height", CM_PER_UNIT)),
+        # smoking
+        (rf"(?:{I_DO})?{QUIT}smoking", constant("is_smoker", value=False)),
+        (rf"{I_DO}{NOT}smoke", constant("is_smoker", value=False)),
+        (rf"{I_AM}(?:a )?non-? ?smoker", constant("is_smoker", value=False)),
+        (rf"(?:{I_DO})?{START}smoking", constant("is_smoker", value=True)),
+        (
+            rf"(?:{I_DO})?(?:smoke|smoked)(?: cigarettes| heavily| a lot| every day| daily| a pack a day)?",
+            constant("is_smoker", value=True),
+        ),
+        (rf"{I_AM}a (?:heavy |chain )?smoker", constant("is_smoker", value=True)),
+        # exercise
+        (rf"(?:{I_DO})?{QUIT}{EXERCISE}", constant("is_physically_active", value=False)),
+        (rf"{I_DO}{NOT}(?:exercise|work out|go to the gym|do sports?)", constant("is_physically_active", value=False)),
+        (
+            rf"{I_AM}(?:not (?:physically )?active|inactive|sedentary|a couch potato)",
+            constant("is_physically_active", value=False),
+        ),
+        (rf"(?:{I_DO})?{START}(?:{EXERCISE}|to exercise|to work out)", constant("is_physically_active", value=True)),
+        (
+            (
+                rf"(?:{I_DO})?(?:exercise|work out|go to the gym|run|go running)"
+                r"(?: regularly| daily| every day| a lot| often)?"
+            ),
+            constant("is_physically_active", value=True),
+        ),
+        (rf"{I_AM}(?:very )?(?:physically )?active", constant("is_physically_active", value=True)),
+        # alcohol
+        (rf"(?:{I_DO})?{QUIT}{DRINKING}", constant("alcohol_consumption", value=0.0)),
+        (rf"{I_DO}{NOT}drink(?: alcohol)?", constant("alcohol_consumption", value=0.0)),
+        (rf"{I_AM}(?:sober|teetotal|a teetotaller|a non-? ?drinker)", constant("alcohol_consumption", value=0.0)),
+        (rf"(?:{I_DO})?{START}{DRINKING}{DRINKING_FREQUENCY}", drink),
+        (rf"(?:{I_DO})?(?:drink|drank)(?: alcohol)?{DRINKING_FREQUENCY}", drink),
+        (rf"{I_AM}(?:an alcoholic|addicted to alcohol)", constant("alcohol_consumption", value=ALCOHOL_ADDICTED)),
+        (rf"{I_AM}a heavy drinker", constant("alcohol_consumption", value=ALCOHOL_HEAVY)),
+        (rf"{I_AM}a social drinker", constant("alcohol_consumption", value=ALCOHOL_SOCIAL)),
+        (rf"(?:{I_DO})?drink (?P<direction>more|less)(?: alcohol)?", drink_more_or_less),
+    )
+)
+
+
+def clamp_physical_attributes(physical_attributes: dict[str, Any]) -> dict[str, Any]:
+    """
+    Clamps the numeric attributes to the ranges the models were trained on, rounded like the rest of our data.
+    """
+    clamped = dict(physical_attributes)
+    for key, (low, high) in PHYSICAL_ATTRIBUTES.ranges.items():
+        value = clamped.get(key)
+        if value is None or isinstance(value, bool):
+            continue
+        clamped[key] = min(max(value, low), high)
+
+    clamped["age"] = round(clamped["age"])
+    clamped["weight"] = round(clamped["weight"], 1)
+    clamped["height"] = round(clamped["height"], 1)
+    clamped["alcohol_consumption"] = round(clamped["alcohol_consumption"], 2)
+    return clamped
+
+
+def apply_prompt_rules(physical_attributes: dict[str, Any], prompt: str) -> dict[str, Any] | None:
+    """
+    Applies a "what if" prompt to the physical attributes if every clause of it matches a rule, else None.
+    """
+    prompt = normalize_prompt(prompt).replace("\u2019", "'")
+    clauses = [clause for clause in CLAUSE_SEPARATOR.split(prompt) if clause]
+    if not clauses:
+        return None
+
+    updated = canonical_physical_attributes(physical_attributes)
+    for clause in clauses:
+        for pattern, rule in RULES:
+            match = pattern.fullmatch(clause)
+            if match is not None:
+                rule(updated, match)
+                break
+        else:
+            return None
+
+    return clamp_physical_attributes(updated)
+
+
+class PromptRules:
+    """
+    Local fast path in front of Gemini for prompts that only make simple, explicit changes.
+    """
+
+    def __init__(self, name: str, *, enabled: bool = PROMPT_RULES_ENABLED):
+        self.name = name
+        self.enabled = enabled
+
+        self._hits = 0
+        self._misses = 0
+
+    def rewrite(self, physical_attributes: dict[str, Any], prompt: str) -> dict[str, Any] | None:
+        if not self.enabled:
+            return None
+
+        rewritten = apply_prompt_rules(physical_attributes, prompt)
+        if rewritten is None:
+            self._misses += 1
+            logger.debug("No prompt rule matched prompt=%r", prompt)
+        else:
+            self._hits += 1
+        return rewritten
+
+    def stats(self) -> dict[str, Any]:
+        total = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
+
+
+prompt_rules = PromptRules("prompt_rules")
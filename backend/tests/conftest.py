@@ -0,0 +1,6 @@
+import os
+
+# the app reads its configuration at import time, and importing anything under src imports the app
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("MONGO_DB_NAME", "test")
+os.environ.setdefault("MONGO_COLLECTION_NAME", "series")
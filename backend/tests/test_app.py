@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+
+import src.database
+from benchmarks.fake_mongo import InMemoryMotorClient
+from benchmarks.fake_mongo import UpdateOne
+from src.app import app
+from src.database import db
+
+SERIES_DAY = {
+    "timestamp": datetime(2024, 1, 1),  # noqa: DTZ001 - series days are stored as naive local midnights
+    "HKQuantityTypeIdentifierHeartRate": [70.0] * 24,
+    "HKQuantityTypeIdentifierStepCount": [100.0] * 24,
+    "HKQuantityTypeIdentifierRespiratoryRate": [14.0] * 24,
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Calls the app against a fresh in-memory Mongo in which every user already has one day of series."""
+    monkeypatch.setattr(src.database, "AsyncIOMotorClient", InMemoryMotorClient)
+    monkeypatch.setattr(src.database, "UpdateOne", UpdateOne)
+
+    async def request(method, url, user_id, **kwargs):
+        await db.upsert_series_days(user_id, [SERIES_DAY])
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.request(method, url, headers={"x-user-id": user_id}, **kwargs)
+
+    with asyncio.Runner() as runner:
+        runner.run(db.connect())
+        yield lambda *args, **kwargs: runner.run(request(*args, **kwargs))
+
+
+def test_series_without_attributes_is_not_found(client):
+    response = client("GET", "/get-physical-attributes/", "series-only")
+    assert response.status_code == httpx.codes.NOT_FOUND
+
+
+def test_attributes_hide_the_series_revision(client):
+    attributes = {
+        "age": 30,
+        "height": 180.0,
+        "weight": 75.0,
+        "is_physically_active": True,
+        "is_smoker": False,
+        "alcohol_consumption": 0.1,
+    }
+    assert client("POST", "/submit-physical-attributes/", "user", json=attributes).is_success
+
+    response = client("GET", "/get-physical-attributes/", "user")
+    assert response.json() == {"_id": "user", **attributes}
@@ -0,0 +1,39 @@
+import io
+import json
+
+import pytest
+
+from src.database import iter_json_array
+
+RECORDS = [
+    {"type": "HKQuantityTypeIdentifierHeartRate", "startDate": "2024-01-01T10:15:00+02:00", "value": 72.5},
+    {"type": "HKQuantityTypeIdentifierStepCount", "startDate": "2024-01-01T10:20:00+02:00", "value": 3e4},
+    [1, -0.25, 1.5e-3, True, None, "a, b ]"],
+    -12,
+    1234567.125,
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7, 16, 1 << 20])
+@pytest.mark.parametrize(
+    "text",
+    [
+        json.dumps(RECORDS),
+        json.dumps(RECORDS, indent=2),
+        "[2.5, 1]",
+        "[3e4, 1]",
+        "[ 10 ,20.75 ]",
+        "[]",
+        "",
+    ],
+)
+def test_iter_json_array_across_chunk_boundaries(text, chunk_size):
+    expected = json.loads(text) if text else []
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 20])
+@pytest.mark.parametrize("text", ["[1, 2", "[1, 2.5", '[{"a": 1}', "[1 2]", "{}"])
+def test_iter_json_array_rejects_malformed_input(text, chunk_size):
+    with pytest.raises(ValueError, match="JSON array"):
+        list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from simulation.backends import EagerBackend
+from simulation.backends import OnnxRuntimeBackend
+from simulation.backends import TorchScriptBackend
+from simulation.export import PARITY_ATOL
+from simulation.export import example_inputs
+from simulation.export import export_onnx
+from simulation.export import export_torchscript
+from simulation.export import max_difference
+from simulation.registry import MODEL_SPECS
+from simulation.registry import model_class
+
+CPU = torch.device("cpu")
+
+
+def fresh_model(model_name):
+    """An untrained model, so the test doesn't depend on checkpoints being present."""
+    torch.manual_seed(0)
+    return model_class(model_name)().eval()
+
+
+def assert_matches_eager(model, backend, model_name):
+    # traced at batch size 4, checked at other sizes to catch shapes baked into the export
+    for batch_size in (1, 64):
+        inputs = example_inputs(model_name, batch_size)
+        assert max_difference(EagerBackend(model, CPU)(*inputs), backend(*inputs)) <= PARITY_ATOL
+
+
+@pytest.mark.parametrize("model_name", list(MODEL_SPECS))
+def test_torchscript_export_matches_eager(tmp_path, model_name):
+    model = fresh_model(model_name)
+    path = tmp_path / "model.torchscript"
+    export_torchscript(model, example_inputs(model_name), path)
+
+    assert_matches_eager(model, TorchScriptBackend(path, CPU), model_name)
+
+
+@pytest.mark.parametrize("model_name", list(MODEL_SPECS))
+def test_onnx_export_matches_eager(tmp_path, model_name):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    model = fresh_model(model_name)
+    path = tmp_path / "model.onnx"
+    export_onnx(model_name, model, example_inputs(model_name), path)
+
+    assert_matches_eager(model, OnnxRuntimeBackend(path), model_name)
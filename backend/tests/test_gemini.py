@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import src.gemini
+from simulation.normalization import PHYSICAL_ATTRIBUTES
+from src.cache import TieredCache
+
+ATTRIBUTES = {
+    "age": 30,
+    "is_physically_active": True,
+    "weight": 80.0,
+    "height": 180.0,
+    "alcohol_consumption": 0.2,
+    "is_smoker": False,
+}
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Answers every Gemini call with `gemini.answer` and counts the calls."""
+    state = SimpleNamespace(answer=None, calls=0)
+
+    async def call_gemini_json_async(prompt):
+        state.calls += 1
+        return state.answer
+
+    monkeypatch.setattr(src.gemini, "call_gemini_json_async", call_gemini_json_async)
+    monkeypatch.setattr(src.gemini, "attribute_rewrite_cache", TieredCache("test", None, maxsize=8, ttl_seconds=60))
+    return state
+
+
+def assert_within_training_ranges(physical_attributes):
+    for key, (low, high) in PHYSICAL_ATTRIBUTES.ranges.items():
+        assert low <= physical_attributes[key] <= high, key
+
+
+def test_prompt_rules_clamp(gemini):
+    rewritten = asyncio.run(src.gemini.rewrite_physical_attributes(ATTRIBUTES, "What if I were 30 years older?"))
+
+    assert gemini.calls == 0
+    assert rewritten["age"] == PHYSICAL_ATTRIBUTES.ranges["age"][1]
+    assert_within_training_ranges(rewritten)
+
+
+def test_gemini_rewrite_is_clamped(gemini):
+    # Gemini drops the unchanged attributes and overshoots the changed ones
+    gemini.answer = {"age": 75, "weight": 300.0, "alcohol_consumption": 3}
+
+    rewritten = asyncio.run(src.gemini.rewrite_physical_attributes(ATTRIBUTES, "What if I had type 2 diabetes?"))
+
+    assert gemini.calls == 1
+    assert rewritten == {**ATTRIBUTES, "age": 40, "weight": 130.0, "alcohol_consumption": 1.0}
+    assert_within_training_ranges(rewritten)
+
+
+def test_unusable_gemini_rewrite_fails(gemini):
+    gemini.answer = {"age": "old"}
+
+    assert asyncio.run(src.gemini.rewrite_physical_attributes(ATTRIBUTES, "What if I had type 2 diabetes?")) is None
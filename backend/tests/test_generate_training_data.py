@@ -0,0 +1,112 @@
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# the simulation scripts import their siblings as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "simulation"))
+
+import generate_training_data as gtd
+from stub_llm import StubLLM
+
+DAYS = 12
+
+
+class Interrupted(BaseException):
+    """Stands in for a Ctrl-C or a killed process, which the retry loop must not swallow."""
+
+
+class InterruptingLLM(StubLLM):
+    def __init__(self, answers, **kwargs):
+        super().__init__(**kwargs)
+        self.answers = answers
+
+    async def __call__(self, prompt):
+        if self.calls >= self.answers:
+            raise Interrupted
+        return await super().__call__(prompt)
+
+
+@pytest.fixture
+def series_days():
+    return [
+        {
+            "day": f"2024-01-{day + 1:02d}",
+            "series_data": {
+                "HKQuantityTypeIdentifierHeartRate": [60.0 + day] * 24,
+                "HKQuantityTypeIdentifierStepCount": [100.0 * day] * 24,
+                "HKQuantityTypeIdentifierRespiratoryRate": [14.0] * 24,
+            },
+        }
+        for day in range(DAYS)
+    ]
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # the backoff between retries would otherwise take seconds
+    sleep = asyncio.sleep
+
+    async def instant_sleep(_delay, *args, **kwargs):
+        await sleep(0)
+
+    monkeypatch.setattr(gtd.asyncio, "sleep", instant_sleep)
+
+
+def written_days(fp):
+    with fp.open() as f:
+        return [json.loads(line)["day"] for line in f]
+
+
+@pytest.mark.usefixtures("no_backoff")
+def test_resumed_run_completes_without_duplicates(tmp_path, series_days):
+    fp = tmp_path / "training_data.jsonl"
+
+    with pytest.raises(Interrupted):
+        asyncio.run(gtd.generate_training_data(series_days, fp, llm=InterruptingLLM(5, seed=0), rate=1000))
+    interrupted = written_days(fp)
+    assert 0 < len(interrupted) < DAYS
+
+    # a crash can also leave half a line behind
+    with fp.open("a") as f:
+        f.write('{"day": "2024-01-')
+
+    llm = StubLLM(failure_rate=0.3, malformed_rate=0.2, seed=1)
+    progress = asyncio.run(gtd.generate_training_data(series_days, fp, llm=llm, rate=1000, max_retries=20))
+
+    days = written_days(fp)
+    assert sorted(days) == sorted(entry["day"] for entry in series_days)
+    assert days[: len(interrupted)] == interrupted
+    assert progress["written"] == DAYS - len(interrupted)
+    assert progress["failed"] == 0
+    assert progress["retries"] > 0
+    assert llm.calls == progress["written"] + progress["retries"]
+
+
+@pytest.mark.usefixtures("no_backoff")
+def test_failed_days_are_retried_on_the_next_run(tmp_path, series_days):
+    fp = tmp_path / "training_data.jsonl"
+
+    progress = asyncio.run(
+        gtd.generate_training_data(series_days, fp, llm=StubLLM(failure_rate=1.0), rate=1000, max_retries=2),
+    )
+    assert progress == {"written": 0, "failed": DAYS, "retries": 2 * DAYS}
+
+    progress = asyncio.run(gtd.generate_training_data(series_days, fp, llm=StubLLM(seed=0), rate=1000))
+    assert progress["written"] == DAYS
+    assert len(set(written_days(fp))) == DAYS
+
+
+def test_token_bucket_paces_acquisitions():
+    bucket = gtd.TokenBucket(rate=50, capacity=1)
+
+    async def acquire_all():
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+
+    start = time.monotonic()
+    asyncio.run(acquire_all())
+    # the first call takes the burst token, the other five wait 1/50s each
+    assert time.monotonic() - start >= 5 / 50 * 0.9